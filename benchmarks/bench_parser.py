@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Benchmark the GE page parser backends.
+
+Usage: python benchmarks/bench_parser.py [PAGES_DIR] [--repeat N]
+
+Every page (*.html) in PAGES_DIR is parsed with each available backend,
+pages named *item*.html as item pages and every other page as a search
+result page. The output of every backend is checked against the
+html.parser fallback before its throughput is printed, so a change in the
+GE markup that breaks a backend fails here instead of in the CLI.
+The bundled sample pages follow the layouts read by
+gppc._parser._SearchPageParser and gppc._parser._ItemPageParser, add pages
+saved from the GE site (secure.runescape.com/m=itemdb_oldschool/results?query=...
+and .../viewitem?obj=...) to measure against the live markup.
+
+Copyright (C) 2022 moxxos
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+from gppc._parser import _BACKENDS, lxml_html
+
+_PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+_PAGE_KINDS = ('search', 'item')  # index of the parse function in gppc._parser._BACKENDS
+
+
+def _load_pages(pages_dir: str) -> dict[str, dict[str, str]]:
+    """Return page kind -> file name -> page."""
+    pages = {kind: {} for kind in _PAGE_KINDS}
+    for file_name in sorted(os.listdir(pages_dir)):
+        if file_name.endswith('.html'):
+            with open(os.path.join(pages_dir, file_name), 'r', encoding='utf-8') as page:
+                pages['item' if 'item' in file_name else 'search'][file_name] = page.read()
+    return pages
+
+
+def _check_and_time(name: str, kind: str, pages: dict[str, str], repeat: int) -> bool:
+    """Compare a backend with the html backend on pages and print its throughput."""
+    parse = _BACKENDS[name][_PAGE_KINDS.index(kind)]
+    reference = _BACKENDS['html'][_PAGE_KINDS.index(kind)]
+    failed = False
+    for file_name, page in pages.items():
+        if parse(page) != reference(page):
+            print(f'{name}: {kind} output differs from the html backend on {file_name}')
+            failed = True
+    page_bytes = sum(len(page.encode('utf-8')) for page in pages.values())
+    seconds = timeit.timeit(lambda: [parse(page) for page in pages.values()], number=repeat)
+    print(f'{name:>6} {kind:>6}: {len(pages) * repeat / seconds:10.1f} pages/s '
+          f'{page_bytes * repeat / seconds / 1e6:8.2f} MB/s')
+    return failed
+
+
+def _main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the GE page parser backends.')
+    parser.add_argument('pages_dir', nargs='?', default=_PAGES_DIR)
+    parser.add_argument('--repeat', type=int, default=200, help='parses of each page per backend')
+    args = parser.parse_args()
+
+    pages = _load_pages(args.pages_dir)
+    if not any(pages.values()):
+        print('no .html pages found in ' + args.pages_dir)
+        return 1
+    backends = [name for name in _BACKENDS if name != 'lxml' or lxml_html is not None]
+
+    failed = False
+    for name in backends:
+        for kind in _PAGE_KINDS:
+            if pages[kind]:
+                failed |= _check_and_time(name, kind, pages[kind], args.repeat)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
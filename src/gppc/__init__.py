@@ -12,5 +12,12 @@ from gppc.__description__ import (
     __author__,
     __title__,
     __copyright__)
-from gppc._gppc import _main, _search_print as search
+from gppc._gppc import _main, _search_print as search, _iter_search_item_data as search_iter
 from gppc._item import Item, Catalog
+from gppc._search import _iter_local_search as search_local
+from gppc._http import configure_transport
+from gppc._parser import set_parser_backend
+from gppc._source import configure_history_sources, history_source_stats
+from gppc._cache import configure_history_cache, clear_history_cache, history_cache_stats
+from gppc._retention import configure_retention, compact_history
+from gppc._export import export_history, read_history
@@ -0,0 +1,145 @@
+"""
+Implements the process wide cache of recent item history.
+
+Every Item shares one cache keyed by (item id, API timestep). Entries expire
+at the end of the timestep bucket they were fetched in, the least recently
+used ones are evicted once the cache is over its memory budget and
+concurrent requests for the same key wait for a single download.
+
+Copyright (C) 2022 moxxos
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+from gppc._constant import _HISTORY_CACHE_BYTES, _HISTORY_RECORD_BYTES
+
+
+class _TtlCache():
+    """
+    Thread safe LRU cache whose entries expire at a given time.
+    The size of an entry is estimated by sizeof and the total is kept under max_bytes.
+    """
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[object], int]) -> None:
+        self.__max_bytes = max_bytes
+        self.__sizeof = sizeof
+        self.__entries = OrderedDict()  # key -> (expires at, value, size), oldest use first
+        self.__loading = {}  # key -> Future of the download in progress
+        self.__bytes = 0
+        self.__lock = threading.Lock()
+        self.__counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+
+    def get(self, key: Hashable, expires_at: Callable[[float], float],
+            load: Callable[[], object]) -> object:
+        """
+        Return the cached value of key, calling load on a miss.
+        expires_at maps the load time to the time the value expires.
+        Errors raised by load are passed to every waiting caller and not cached.
+        """
+        with self.__lock:
+            now = time.time()
+            if (entry := self.__entries.get(key)) is not None:
+                if entry[0] > now:
+                    self.__entries.move_to_end(key)
+                    self.__counters['hits'] += 1
+                    return entry[1]
+                self.__remove(key)
+            loading = self.__loading.get(key)
+            if (owner := loading is None):
+                self.__counters['misses'] += 1
+                loading = self.__loading[key] = Future()
+            else:
+                self.__counters['coalesced'] += 1
+        if not owner:
+            return loading.result()
+
+        loaded_at = time.time()
+        try:
+            value = load()
+        except BaseException as error:
+            with self.__lock:
+                del self.__loading[key]
+            loading.set_exception(error)
+            raise
+        with self.__lock:
+            del self.__loading[key]
+            self.__store(key, expires_at(loaded_at), value)
+        loading.set_result(value)
+        return value
+
+    def __remove(self, key: Hashable) -> None:
+        self.__bytes -= self.__entries.pop(key)[2]
+
+    def __store(self, key: Hashable, expires: float, value: object) -> None:
+        if key in self.__entries:
+            self.__remove(key)
+        size = self.__sizeof(value)
+        if size > self.__max_bytes:
+            return
+        self.__entries[key] = (expires, value, size)
+        self.__bytes += size
+        self.__evict()
+
+    def __evict(self) -> None:
+        while self.__bytes > self.__max_bytes:
+            self.__remove(next(iter(self.__entries)))
+            self.__counters['evictions'] += 1
+
+    def configure(self, max_bytes: int) -> None:
+        with self.__lock:
+            self.__max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {**self.__counters,
+                    'entries': len(self.__entries),
+                    'bytes': self.__bytes,
+                    'max_bytes': self.__max_bytes}
+
+
+def _history_sizeof(value: tuple[list[dict] | None, float, bool]) -> int:
+    """Estimated size of a cached (history records, fetched at, stored) entry."""
+    return _HISTORY_RECORD_BYTES * (1 + len(value[0] or ()))
+
+
+_history_cache = _TtlCache(_HISTORY_CACHE_BYTES, _history_sizeof)
+
+
+def _get_history_cache() -> _TtlCache:
+    return _history_cache
+
+
+def _bucket_end(width: int) -> Callable[[float], float]:
+    """Return an expiry function for the end of the width second bucket a time falls in."""
+    return lambda loaded_at: (loaded_at // width + 1) * width
+
+
+def configure_history_cache(max_bytes: int) -> None:
+    """
+    Set the memory budget of the recent history cache shared by every Item.
+
+    :param max_bytes: estimated size the cache is kept under, 0 disables caching
+    """
+    if max_bytes < 0:
+        raise ValueError('max_bytes must not be negative')
+    _history_cache.configure(max_bytes)
+
+
+def clear_history_cache() -> None:
+    """Drop every cached recent history, the counters are kept."""
+    _history_cache.clear()
+
+
+def history_cache_stats() -> dict:
+    """Return the hits, misses, coalesced requests, evictions and size of the history cache."""
+    return _history_cache.stats()
@@ -0,0 +1,83 @@
+"""
+Implements columnar storage of the item mapping.
+
+Copyright (C) 2022 moxxos
+"""
+
+import numpy
+
+from gppc._index import _ItemIndex
+from gppc._mapping import _raw_list, _mapping_version
+
+_INT_COLUMNS = ('id', 'limit', 'value', 'lowalch', 'highalch')
+_BOOL_COLUMNS = ('members',)
+_MISSING = -1  # stored in place of absent values, real values are never negative
+_OPERATORS = {'eq': numpy.equal, 'ne': numpy.not_equal,
+              'lt': numpy.less, 'lte': numpy.less_equal,
+              'gt': numpy.greater, 'gte': numpy.greater_equal}
+
+
+class _MappingColumns():
+    """The item mapping as one array per attribute, indexed by mapping position."""
+
+    def __init__(self, raw_list: list[dict]) -> None:
+        self.__raw_list = raw_list
+        self.__index = None  # built on the first name or id lookup
+        self.names = [item['name'] for item in raw_list]
+        self.columns = {}  # attribute -> numpy array
+        for column in _INT_COLUMNS:
+            self.columns[column] = numpy.fromiter(
+                (_MISSING if (value := item.get(column)) is None else value for item in raw_list),
+                dtype=numpy.int32, count=len(raw_list))
+        for column in _BOOL_COLUMNS:
+            self.columns[column] = numpy.fromiter((bool(item.get(column)) for item in raw_list),
+                                                  dtype=numpy.bool_, count=len(raw_list))
+        self.ids = self.columns['id']
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def position(self, key: str | int) -> int | None:
+        """
+        Return the position of an item name or id in these columns.
+        Positions stay valid after the mapping is replaced, unlike _get_index().
+        """
+        if self.__index is None:
+            self.__index = _ItemIndex(self.__raw_list)
+        return self.__index.position(key)
+
+    def match(self, column: str, operator: str, value, positions: numpy.ndarray) -> numpy.ndarray:
+        """
+        Return a mask of the mapping positions whose column value satisfies operator.
+        Items without the attribute only match value None.
+        """
+        if column not in self.columns:
+            raise ValueError('Attribute must be one of: ' + str(list(self.columns)))
+        values = self.columns[column][positions]
+        present = values != _MISSING if column in _INT_COLUMNS else numpy.True_
+        if value is None:
+            if operator not in ('eq', 'ne'):
+                raise ValueError('None can only be compared with eq or ne')
+            return ~present if operator == 'eq' else present
+        if operator == 'in':
+            matched = numpy.isin(values, list(value))
+        elif operator == 'range':
+            low, high = value
+            matched = (values >= low) & (values <= high)
+        elif operator in _OPERATORS:
+            matched = _OPERATORS[operator](values, value)
+        else:
+            raise ValueError('Operator must be one of: ' + str([*_OPERATORS, 'in', 'range']))
+        return matched & present
+
+
+_columns_cache = {'version': None, 'columns': None}
+
+
+def _get_columns() -> _MappingColumns:
+    """Return the mapping columns, rebuilding them whenever the mapping changes."""
+    version = _mapping_version()
+    if _columns_cache['version'] != version:
+        _columns_cache['columns'] = _MappingColumns(_raw_list())
+        _columns_cache['version'] = version
+    return _columns_cache['columns']
@@ -2,7 +2,10 @@
 _WIKI_API = 'https://prices.runescape.wiki/api/v1/osrs'
 _MAP_API = _WIKI_API + '/mapping'
 _TIMESTEP_PARAMETER = 'TIMESTEP_PARAMETER'
+_TIMESTEP_SECONDS = {'5m': 300, '1h': 3600, '6h': 21600, '24h': 86400}
 _HISTORY_API = _WIKI_API + '/timeseries?timestep=' + _TIMESTEP_PARAMETER + '&id='
+# whole market endpoints, each returns every item in one response
+_SNAPSHOT_API = {'latest': _WIKI_API + '/latest', '5m': _WIKI_API + '/5m', '1h': _WIKI_API + '/1h'}
 _MAIN_URL = 'https://secure.runescape.com/m=itemdb_oldschool'
 _ITEM_URL = _MAIN_URL + '/viewitem?obj='
 _ITEM_PATH = '/viewitem?obj'
@@ -12,3 +15,28 @@ _POST_PARAMETER = 'query'
 _REQUEST_HEADER = {'user-agent': 'gppc - https://github.com/moxxos/gppc'}
 _SM_IMG_SIZE = 7
 _LG_IMG_SIZE = 9
+_MAPPING_TTL = 6 * 60 * 60  # seconds before the cached mapping is revalidated
+_MAPPING_RETRY = 60  # seconds between failed revalidation attempts
+_MAPPING_TIMEOUT = 30
+_LATEST_TTL = 60  # seconds before local search requests /latest prices again
+_CONNECT_TIMEOUT = 5
+_READ_TIMEOUT = 20
+_HTTP_RETRIES = 3
+_HTTP_BACKOFF = 0.5
+_HTTP_POOL_SIZE = 16
+# host -> (requests per second, burst)
+_RATE_LIMITS = {'prices.runescape.wiki': (5, 10), 'secure.runescape.com': (2, 4)}
+_DEFAULT_RATE_LIMIT = (5, 10)
+_SOURCE_WINDOW = 50  # requests kept in the rolling stats of each history source
+_SOURCE_MAX_ERROR_RATE = 0.5  # history sources failing more often are tried last
+_HEDGE_PERCENTILE = 95  # latency percentile after which a history request is hedged
+_HEDGE_DELAY = 2  # seconds before hedging while a source has too few samples
+_HEDGE_MIN_SAMPLES = 5
+_HEDGE_WORKERS = 4  # hedged history requests in flight at once
+_HISTORY_CACHE_BYTES = 64 * 1024 * 1024  # memory budget of the recent history cache
+_HISTORY_RECORD_BYTES = 400  # estimated size of one cached history record
+# API timestep -> seconds its stored history is kept before being rolled up into
+# the next coarser timestep, None keeps it forever. Each retention is longer than
+# the 365 buckets the timeseries API returns so synced history is not rolled up again.
+_RETENTION = {'5m': 2 * 24 * 60 * 60, '1h': 30 * 24 * 60 * 60, '6h': 180 * 24 * 60 * 60,
+              '24h': None}
@@ -4,16 +4,30 @@ Implements caching functionality.
 Copyright (C) 2022 moxxos
 """
 
+import heapq
 import sqlite3
+import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import date
+from itertools import islice
+from typing import Iterator
 
 import pandas
 from platformdirs import user_data_dir
 
 from gppc.__description__ import __title__, __author__
+from gppc._constant import _TIMESTEP_SECONDS
+from gppc._frame import _history_frame, _HISTORY_COLUMNS
 
 _DATABASE_NAME = 'gppc.sql'
+_BUSY_TIMEOUT = 30  # seconds to wait for another process holding the write lock
+_CACHE_SIZE_KB = 64 * 1024
+_MMAP_SIZE = 256 * 1024 * 1024
+_MAX_SQL_IDS = 500  # longest id list passed as query parameters
+_COMPACT_BATCH = 200  # items rolled up per transaction by compact_history
+_HISTORY_CHUNK = 10_000  # history rows read at a time by get_item_history and Item.iter_history
 _INFO_TABLE = 'info_table'
 _ITEM_ID = 'id'
 _ITEM_NAME = 'name'
@@ -25,11 +39,48 @@ _ITEM_HIGH_ALCH = 'highalch'
 _ITEM_VALUE = 'value'
 _ITEM_WIKI_IMG = 'icon'  # name of item image on the wiki
 _ITEM_IMG = 'default_img'  # transformed ANSI terminal image
+_HISTORY_TABLE = 'history'
+_HISTORY_ID = 'item_id'
+_TIMESTEP = 'timestep'  # bucket width in seconds
 _DATE = 'timestamp'  # will always be UNIX timestamp
 _AVG_HIGH = 'avgHighPrice'
 _AVG_LOW = 'avgLowPrice'
 _HIGH_VOL = 'highPriceVolume'
 _LOW_VOL = 'lowPriceVolume'
+_LATEST_TABLE = 'latest'
+_SYNC_TABLE = 'sync_state'
+_ICON_TABLE = 'icon_table'  # raw item pictures
+_ICON_RENDER_TABLE = 'icon_render'  # ANSI renderings of item pictures by width
+_ICON = 'icon'  # picture file name
+_ICON_DATA = 'data'
+_ICON_SIZE = 'size'
+_ICON_ANSI = 'ansi'
+_LAST_DATE = 'last_timestamp'  # newest stored bucket of the last sync
+_SYNCED_AT = 'synced_at'  # UNIX time of the last sync
+_HIGH = 'high'
+_HIGH_TIME = 'highTime'
+_LOW = 'low'
+_LOW_TIME = 'lowTime'
+
+
+def _appdata_path() -> str:
+    """Return the gppc data directory, creating it if it does not exist."""
+    appdata_path = user_data_dir(__title__, __author__)
+    if not os.path.exists(appdata_path):
+        os.makedirs(appdata_path)
+    return appdata_path
+
+
+_schema_ready = set()  # database paths whose tables exist
+_local = threading.local()
+
+
+def _get_db() -> 'DbManager':
+    """Return the DbManager shared by the calling thread."""
+    db_man = getattr(_local, 'db_man', None)
+    if db_man is None or db_man.closed:
+        db_man = _local.db_man = DbManager()
+    return db_man
 
 
 def _clear_cache():
@@ -40,11 +91,12 @@ def _clear_cache():
 
 class DbManager():
     """
-    Each item has it's own table that looks like:
-                Table Name: id
-    date  |  avg high  |  avg low  |  high vol  |  low vol
-    date1 |    high1   |    low1   |   highvol1 |   lowvol1
-    date2 | ...
+    All item history is stored in a single WITHOUT ROWID table keyed by
+    (item id, timestep, timestamp) where timestep is the bucket width in seconds:
+                Table Name: history
+    item id |  timestep  |  timestamp  |  avg high  |  avg low  |  high vol  |  low vol
+    id1     |    300     |    date1    |   high1    |   low1    |  highvol1  |  lowvol1
+    id1     |    300     |    date2    | ...
     .
     .
     .
@@ -59,44 +111,134 @@ class DbManager():
     .
     """
 
-    def __init__(self) -> None:
-
-        appdata_path = user_data_dir(__title__, __author__)
-        if not os.path.exists(appdata_path):
-            os.makedirs(appdata_path)
+    def __init__(self, db_path: str = None) -> None:
+        db_path = db_path if db_path else os.path.join(_appdata_path(), _DATABASE_NAME)
         # Connect to databse if it exists.
         # If not create databse and connect.
-        self.__db_conn = sqlite3.connect(os.path.join(appdata_path, _DATABASE_NAME))
+        self.__db_conn = sqlite3.connect(db_path, timeout=_BUSY_TIMEOUT)
         # Create cursor to manipulate databse.
         self.__db_cur = self.__db_conn.cursor()
+        self.__depth = 0  # nesting level of transaction()
+        self.__closed = False
+
+        # only applies to new databases, existing ones switch on compact_history(vacuum=True)
+        self.__db_cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        # WAL lets readers work alongside the single writer, with WAL a
+        # synchronous level of NORMAL only syncs at checkpoints
+        self.__db_cur.execute('PRAGMA journal_mode=WAL')
+        self.__db_cur.execute('PRAGMA synchronous=NORMAL')
+        self.__db_cur.execute(f'PRAGMA cache_size=-{_CACHE_SIZE_KB}')
+        self.__db_cur.execute(f'PRAGMA mmap_size={_MMAP_SIZE}')
+        self.__db_cur.execute('PRAGMA temp_store=MEMORY')
+
+        # Only check the schema once per database and process.
+        if db_path not in _schema_ready:
+            self.__create_schema()
+            _schema_ready.add(db_path)
 
+    def __create_schema(self) -> None:
         # Create name_id_pic table if it does not exist.
-        result = self.__db_cur.execute(f"""
-                                       SELECT name
-                                       FROM sqlite_master
-                                       WHERE name='{_INFO_TABLE}'""")
-        if result.fetchone() is None:
-            # limit is sql keyword use 'limit' column name instead
-            self.__db_cur.execute(f"""
-                                  CREATE TABLE {_INFO_TABLE} (
-                                    {_ITEM_ID},
-                                    {_ITEM_NAME},
-                                    {_ITEM_EXAMINE},
-                                    {_ITEM_MEMBERS},
-                                    '{_ITEM_LIMIT}',
-                                    {_ITEM_LOW_ALCH},
-                                    {_ITEM_HIGH_ALCH},
-                                    {_ITEM_VALUE},
-                                    {_ITEM_WIKI_IMG},
-                                    {_ITEM_IMG})""")
+        # limit is sql keyword use 'limit' column name instead
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_INFO_TABLE} (
+                                {_ITEM_ID},
+                                {_ITEM_NAME},
+                                {_ITEM_EXAMINE},
+                                {_ITEM_MEMBERS},
+                                '{_ITEM_LIMIT}',
+                                {_ITEM_LOW_ALCH},
+                                {_ITEM_HIGH_ALCH},
+                                {_ITEM_VALUE},
+                                {_ITEM_WIKI_IMG},
+                                {_ITEM_IMG})""")
+
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_HISTORY_TABLE} (
+                                {_HISTORY_ID} INTEGER NOT NULL,
+                                {_TIMESTEP} INTEGER NOT NULL,
+                                {_DATE} INTEGER NOT NULL,
+                                {_AVG_HIGH} INTEGER,
+                                {_AVG_LOW} INTEGER,
+                                {_HIGH_VOL} INTEGER NOT NULL DEFAULT 0,
+                                {_LOW_VOL} INTEGER NOT NULL DEFAULT 0,
+                                PRIMARY KEY ({_HISTORY_ID}, {_TIMESTEP}, {_DATE})
+                              ) WITHOUT ROWID""")
+
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_LATEST_TABLE} (
+                                {_HISTORY_ID} INTEGER PRIMARY KEY,
+                                {_HIGH} INTEGER,
+                                {_HIGH_TIME} INTEGER,
+                                {_LOW} INTEGER,
+                                {_LOW_TIME} INTEGER)""")
+
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_SYNC_TABLE} (
+                                {_HISTORY_ID} INTEGER NOT NULL,
+                                {_TIMESTEP} INTEGER NOT NULL,
+                                {_LAST_DATE} INTEGER NOT NULL DEFAULT 0,
+                                {_SYNCED_AT} REAL NOT NULL,
+                                PRIMARY KEY ({_HISTORY_ID}, {_TIMESTEP})
+                              ) WITHOUT ROWID""")
+
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_ICON_TABLE} (
+                                {_ICON} TEXT PRIMARY KEY,
+                                {_ICON_DATA} BLOB NOT NULL)""")
+
+        self.__db_cur.execute(f"""
+                              CREATE TABLE IF NOT EXISTS {_ICON_RENDER_TABLE} (
+                                {_ICON} TEXT NOT NULL,
+                                {_ICON_SIZE} INTEGER NOT NULL,
+                                {_ICON_ANSI} TEXT NOT NULL,
+                                PRIMARY KEY ({_ICON}, {_ICON_SIZE})
+                              ) WITHOUT ROWID""")
+        self.__db_conn.commit()
+
+    def __enter__(self) -> 'DbManager':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.__db_conn.commit()
+        else:
+            self.__db_conn.rollback()
+        self.close_db()
+
+    @contextmanager
+    def transaction(self) -> Iterator['DbManager']:
+        """
+        Group writes into a single transaction that is committed on exit
+        and rolled back on error. Nested transactions join the outer one.
+        """
+        self.__depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.__db_conn.rollback()
+            raise
+        self.__depth -= 1
+        if self.__depth == 0:
+            self.__db_conn.commit()
+
+    def __commit(self) -> None:
+        """Commit unless the write is part of an enclosing transaction()."""
+        if self.__depth == 0:
+            self.__db_conn.commit()
+
+    @property
+    def closed(self) -> bool:
+        return self.__closed
 
     def close_db(self) -> None:
         """Close the db."""
+        self.__closed = True
         self.__db_conn.close()
 
     def store_item_info(self, item_info: dict, item_img: str):
-        if 'limit' not in item_info.values():
-            item_info.update({'limit': None})
+        # some items have no buy limit or alch values, e.g. Old school bond
         self.__db_cur.execute(f"""
                               INSERT INTO {_INFO_TABLE} (
                                 {_ITEM_ID},
@@ -115,13 +257,13 @@ class DbManager():
                                   item_info[_ITEM_NAME],
                                   item_info[_ITEM_EXAMINE],
                                   item_info[_ITEM_MEMBERS],
-                                  item_info[_ITEM_LIMIT],
-                                  item_info[_ITEM_LOW_ALCH],
-                                  item_info[_ITEM_HIGH_ALCH],
+                                  item_info.get(_ITEM_LIMIT),
+                                  item_info.get(_ITEM_LOW_ALCH),
+                                  item_info.get(_ITEM_HIGH_ALCH),
                                   item_info[_ITEM_VALUE],
                                   item_info[_ITEM_WIKI_IMG],
                                   item_img))
-        self.__db_conn.commit()
+        self.__commit()
 
     def retrieve_item_info(self, item_id: int):
         result = self.__db_cur.execute(f"""
@@ -130,56 +272,492 @@ class DbManager():
                                        WHERE {_ITEM_ID}={str(item_id)}""")
         return result.fetchone()
 
-    def create_item_table(self, item_id: int) -> None:
+    def store_icon(self, icon: str, data: bytes) -> None:
+        """Store the raw bytes of an item picture once."""
         self.__db_cur.execute(f"""
-                              CREATE TABLE
-                              {'item' + str(item_id)}
-                              ({_DATE} PRIMARY KEY,
-                              {_AVG_HIGH},
-                              {_AVG_LOW},
-                              {_HIGH_VOL},
-                              {_LOW_VOL})""")
-        self.__db_conn.commit()
+                              INSERT OR IGNORE INTO {_ICON_TABLE} ({_ICON}, {_ICON_DATA})
+                              VALUES (?, ?)""", (icon, data))
+        self.__commit()
+
+    def retrieve_icon(self, icon: str) -> bytes | None:
+        """Return the raw bytes of a stored item picture."""
+        result = self.__db_cur.execute(f"""
+                                       SELECT {_ICON_DATA}
+                                       FROM {_ICON_TABLE}
+                                       WHERE {_ICON}=?""", (icon,)).fetchone()
+        return None if result is None else result[0]
+
+    def store_icon_render(self, icon: str, size: int, ansi: str) -> None:
+        """Store the ANSI rendering of an item picture at a width."""
+        self.__db_cur.execute(f"""
+                              INSERT OR IGNORE INTO {_ICON_RENDER_TABLE} (
+                                {_ICON}, {_ICON_SIZE}, {_ICON_ANSI})
+                              VALUES (?, ?, ?)""", (icon, size, ansi))
+        self.__commit()
+
+    def retrieve_icon_render(self, icon: str, size: int) -> str | None:
+        """Return the ANSI rendering of an item picture at a width."""
+        result = self.__db_cur.execute(f"""
+                                       SELECT {_ICON_ANSI}
+                                       FROM {_ICON_RENDER_TABLE}
+                                       WHERE {_ICON}=? AND {_ICON_SIZE}=?""",
+                                       (icon, size)).fetchone()
+        return None if result is None else result[0]
+
+    def create_item_table(self, item_id: int) -> None:
+        """History is kept in a single table, nothing has to be created per item."""
 
     def delete_item_table(self, item_id: int) -> None:
-        self.__db_cur.execute(f"""DROP TABLE {self.id_to_tablename(item_id)}""")
-        self.__db_conn.commit()
+        """Delete all stored history of an item."""
+        self.__db_cur.execute(f"""
+                              DELETE FROM {_HISTORY_TABLE}
+                              WHERE {_HISTORY_ID}=?""", (item_id,))
+        self.__db_cur.execute(f"""
+                              DELETE FROM {_SYNC_TABLE}
+                              WHERE {_HISTORY_ID}=?""", (item_id,))
+        self.__commit()
 
     def item_table_exists(self, item_id: int) -> bool:
+        """Return True if any history is stored for the item."""
         return self.__db_cur.execute(f"""
-                                     SELECT name
-                                     FROM sqlite_master
-                                     WHERE name='{self.id_to_tablename(item_id)}'""").fetchone()
+                                     SELECT 1
+                                     FROM {_HISTORY_TABLE}
+                                     WHERE {_HISTORY_ID}=?
+                                     LIMIT 1""", (item_id,)).fetchone() is not None
 
-    def store_item_history(self, item_id: int, history: pandas.DataFrame):
+    def store_item_history(self, item_id: int, history: list[dict] | pandas.DataFrame,
+                           timestep: int) -> int:
+        """
+        Insert API history records, ignoring buckets that are already stored.
+        Runs in a single transaction and returns the number of new rows.
+        """
         if (history is None):
             raise ValueError('Missing API history data for: ' + self.id_to_tablename(item_id))
+        if isinstance(history, pandas.DataFrame):
+            history = history.astype(object).where(history.notna(), None).to_dict('records')
 
-        past_dates = [row[0] for row in self.__db_cur.execute(f"""
-                                                              SELECT {_DATE}
-                                                              FROM {self.id_to_tablename(item_id)}
-                                                              ORDER BY {_DATE}""").fetchall()]
-
-        # if there are past dates and earliest date to be stored is less than latest
-        # existing stamp then check for dupilcate dates and drop
-        if (past_dates and history.iloc[0][_DATE] <= past_dates[len(past_dates) - 1]):
-            history = history.drop(history[history[_DATE].isin(past_dates)].index)
-        # else no stored dates yet or earliest data to be stored timestamp
-        # is greater than latest existing time stamp just store right away
-        history.to_sql(self.id_to_tablename(item_id),
-                       self.__db_conn, if_exists='append', index=False)
-        self.__db_conn.commit()
-        return len(history)
-
-    def get_item_history(self, item_id: int):
-        history = (self.__db_cur.execute(f"""
-                                         SELECT *
-                                         FROM {self.id_to_tablename(item_id)}
-                                         ORDER BY {_DATE}""").fetchall())
-        if (history):
-            return pandas.DataFrame(history).set_axis([
-                _DATE, _AVG_HIGH, _AVG_LOW, _HIGH_VOL, _LOW_VOL], axis=1)
-        return None
+        changes = self.__db_conn.total_changes
+        with self.transaction():
+            self.__db_cur.executemany(f"""
+                                      INSERT OR IGNORE INTO {_HISTORY_TABLE} (
+                                        {_HISTORY_ID}, {_TIMESTEP}, {_DATE},
+                                        {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL})
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                      ((item_id, timestep, row[_DATE],
+                                        row.get(_AVG_HIGH), row.get(_AVG_LOW),
+                                        row.get(_HIGH_VOL) or 0, row.get(_LOW_VOL) or 0)
+                                       for row in history))
+        # ignored duplicates do not count as changes
+        return self.__db_conn.total_changes - changes
+
+    def store_snapshot(self, snapshot: dict, timestep: int, item_ids: set[int] = None) -> int:
+        """
+        Store a whole market /5m or /1h response as history rows of its bucket
+        in a single transaction. Only items in item_ids are stored if given.
+        Returns the number of new rows.
+        """
+        timestamp = snapshot['timestamp']
+        changes = self.__db_conn.total_changes
+        with self.transaction():
+            self.__db_cur.executemany(f"""
+                                      INSERT OR IGNORE INTO {_HISTORY_TABLE} (
+                                        {_HISTORY_ID}, {_TIMESTEP}, {_DATE},
+                                        {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL})
+                                      VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                                      ((item_id, timestep, timestamp,
+                                        row.get(_AVG_HIGH), row.get(_AVG_LOW),
+                                        row.get(_HIGH_VOL) or 0, row.get(_LOW_VOL) or 0)
+                                       for item_id, row in ((int(key), value) for key, value
+                                                            in snapshot['data'].items())
+                                       if (item_ids is None or item_id in item_ids)
+                                       # skip buckets without trades like the timeseries API
+                                       and (row.get(_HIGH_VOL) or row.get(_LOW_VOL))))
+        return self.__db_conn.total_changes - changes
+
+    def store_latest(self, latest: dict, item_ids: set[int] = None) -> int:
+        """
+        Replace the latest instant buy/sell prices with a whole market /latest
+        response in a single transaction. Returns the number of stored items.
+        """
+        changes = self.__db_conn.total_changes
+        with self.transaction():
+            self.__db_cur.executemany(f"""
+                                      INSERT INTO {_LATEST_TABLE} (
+                                        {_HISTORY_ID}, {_HIGH}, {_HIGH_TIME}, {_LOW}, {_LOW_TIME})
+                                      VALUES (?, ?, ?, ?, ?)
+                                      ON CONFLICT ({_HISTORY_ID}) DO UPDATE SET
+                                        {_HIGH}=excluded.{_HIGH},
+                                        {_HIGH_TIME}=excluded.{_HIGH_TIME},
+                                        {_LOW}=excluded.{_LOW},
+                                        {_LOW_TIME}=excluded.{_LOW_TIME}""",
+                                      ((item_id, row.get(_HIGH), row.get(_HIGH_TIME),
+                                        row.get(_LOW), row.get(_LOW_TIME))
+                                       for item_id, row in ((int(key), value) for key, value
+                                                            in latest['data'].items())
+                                       if item_ids is None or item_id in item_ids))
+        return self.__db_conn.total_changes - changes
+
+    def __select_items(self, query: str, item_ids: list[int] = None) -> list[tuple]:
+        """
+        Run a query whose first column is the item id for the given items only.
+        Short id lists are filtered in SQL, long ones while reading.
+        """
+        if item_ids is None:
+            return self.__db_cur.execute(query).fetchall()
+        if len(item_ids) <= _MAX_SQL_IDS:
+            return self.__db_cur.execute(
+                query + f" WHERE {_HISTORY_ID} IN ({', '.join('?' * len(item_ids))})",
+                list(item_ids)).fetchall()
+        item_ids = set(item_ids)
+        return [row for row in self.__db_cur.execute(query) if row[0] in item_ids]
+
+    def get_latest(self, item_ids: list[int] = None) -> dict[int, tuple]:
+        """Return item id -> (high, highTime, low, lowTime) of the stored latest prices."""
+        rows = self.__select_items(f"""
+                                   SELECT {_HISTORY_ID},
+                                          {_HIGH}, {_HIGH_TIME}, {_LOW}, {_LOW_TIME}
+                                   FROM {_LATEST_TABLE}""", item_ids)
+        return {row[0]: row[1:] for row in rows}
+
+    def update_sync_state(self, item_id: int, timestep: int,
+                          last_timestamp: int, synced_at: float) -> None:
+        """Record a sync of an item timestep, the high-water mark never moves back."""
+        self.__db_cur.execute(f"""
+                              INSERT INTO {_SYNC_TABLE} (
+                                {_HISTORY_ID}, {_TIMESTEP}, {_LAST_DATE}, {_SYNCED_AT})
+                              VALUES (?, ?, ?, ?)
+                              ON CONFLICT ({_HISTORY_ID}, {_TIMESTEP}) DO UPDATE SET
+                                {_LAST_DATE}=MAX({_LAST_DATE}, excluded.{_LAST_DATE}),
+                                {_SYNCED_AT}=MAX({_SYNCED_AT}, excluded.{_SYNCED_AT})""",
+                              (item_id, timestep, last_timestamp, synced_at))
+        self.__commit()
+
+    def get_sync_state(self, item_ids: list[int] = None) -> dict[tuple[int, int], tuple]:
+        """Return (item id, timestep) -> (last timestamp, synced at) of past syncs."""
+        rows = self.__select_items(f"""
+                                   SELECT {_HISTORY_ID}, {_TIMESTEP}, {_LAST_DATE}, {_SYNCED_AT}
+                                   FROM {_SYNC_TABLE}""", item_ids)
+        return {row[:2]: row[2:] for row in rows}
+
+    def get_item_history(self, item_id: int, timestep: int = None,
+                         datetime_index: bool = False, start: int = None, end: int = None,
+                         columns: list[str] = None) -> pandas.DataFrame | None:
+        """
+        Return the stored history of an item ordered by timestamp with UTC
+        datetimes and compact integer dtypes, None if nothing is stored.
+        Without a timestep every timestep is merged, preferring the finest
+        bucket when several timesteps share a timestamp.
+
+        :param start: first UNIX timestamp
+        :param end: last UNIX timestamp, inclusive
+        :param columns: history columns to read, every column by default
+        """
+        chunks = list(self.iter_item_history(item_id, _HISTORY_CHUNK, timestep, start, end,
+                                             columns, datetime_index))
+        if not chunks:
+            return None
+        if len(chunks) == 1:
+            return chunks[0]
+        return pandas.concat(chunks, ignore_index=not datetime_index)
+
+    def iter_item_history(self, item_id: int, chunk_size: int, timestep: int = None,
+                          start: int = None, end: int = None, columns: list[str] = None,
+                          datetime_index: bool = False) -> Iterator[pandas.DataFrame]:
+        """
+        Yield the stored history of an item like get_item_history in
+        DataFrames of at most chunk_size rows. Every timestep is read as a
+        primary key range in timestamp order, so nothing is sorted and only
+        one chunk of rows is held in memory at a time.
+        """
+        if columns is None:
+            columns = _HISTORY_COLUMNS
+        elif not columns or any(column not in _HISTORY_COLUMNS for column in columns):
+            raise ValueError('columns must be some of: ' + str(_HISTORY_COLUMNS))
+        if chunk_size <= 0:
+            raise ValueError('chunk_size must be positive')
+        columns = list(columns)
+        selected = f"{_DATE}, {_TIMESTEP}, {', '.join(columns)}"
+        if timestep is not None:
+            rows = self.__iter_timestep_rows(item_id, timestep, start, end, selected, chunk_size)
+        else:
+            # merge the timesteps by timestamp, the finest bucket of a timestamp wins
+            rows = DbManager.__first_per_timestamp(heapq.merge(
+                *(self.__iter_timestep_rows(item_id, width, start, end, selected, chunk_size)
+                  for width in _TIMESTEP_SECONDS.values()), key=lambda row: row[:2]))
+        while (chunk := [row[2:] for row in islice(rows, chunk_size)]):
+            yield _history_frame(chunk, columns=columns, datetime_index=datetime_index)
+
+    def __iter_timestep_rows(self, item_id: int, timestep: int, start: int | None,
+                             end: int | None, selected: str, batch_size: int) -> Iterator[tuple]:
+        """Yield the selected columns of an item timestep in timestamp order from its own cursor."""
+        # equality on the leading primary key columns and a range on timestamp, an index range
+        conditions = [f"{_HISTORY_ID}=?", f"{_TIMESTEP}=?"]
+        parameters = [item_id, timestep]
+        if start is not None:
+            conditions.append(f"{_DATE}>=?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append(f"{_DATE}<=?")
+            parameters.append(end)
+        cursor = self.__db_conn.execute(f"""
+                                        SELECT {selected}
+                                        FROM {_HISTORY_TABLE}
+                                        WHERE {' AND '.join(conditions)}
+                                        ORDER BY {_DATE}""", parameters)
+        try:
+            while (rows := cursor.fetchmany(batch_size)):
+                yield from rows
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def __first_per_timestamp(rows: Iterator[tuple]) -> Iterator[tuple]:
+        """Yield the first of consecutive rows sharing a timestamp, the first column."""
+        last = None
+        for row in rows:
+            if row[0] != last:
+                last = row[0]
+                yield row
+
+    @staticmethod
+    def __history_filter(item_ids: list[int] = None, timestep: int = None,
+                         start: int = None, end: int = None) -> tuple[str, list]:
+        """Return the WHERE clause and parameters selecting history rows."""
+        conditions = []
+        parameters = []
+        if item_ids is not None:
+            # a single JSON parameter instead of one per id, any number of items
+            conditions.append(f"{_HISTORY_ID} IN (SELECT value FROM json_each(?))")
+            parameters.append(json.dumps(list(item_ids)))
+        if timestep is not None:
+            conditions.append(f"{_TIMESTEP}=?")
+            parameters.append(timestep)
+        if start is not None:
+            conditions.append(f"{_DATE}>=?")
+            parameters.append(start)
+        if end is not None:
+            conditions.append(f"{_DATE}<=?")
+            parameters.append(end)
+        return ('WHERE ' + ' AND '.join(conditions)) if conditions else '', parameters
+
+    def has_history(self, item_ids: list[int], timestep: int, start: int = None,
+                    end: int = None) -> bool:
+        """Return True if any of the items has history of timestep between start and end."""
+        where, parameters = DbManager.__history_filter(item_ids, timestep, start, end)
+        return self.__db_cur.execute(f"""
+                                     SELECT 1
+                                     FROM {_HISTORY_TABLE}
+                                     {where}
+                                     LIMIT 1""", parameters).fetchone() is not None
+
+    def get_history_panel(self, item_ids: list[int] = None, timestep: int = None,
+                          start: int = None, end: int = None) -> list[tuple]:
+        """
+        Return the stored history rows (item id, timestamp, avgHighPrice,
+        avgLowPrice, highPriceVolume, lowPriceVolume) of many items between
+        the UNIX times start and end (inclusive) in one query, ordered by item
+        and timestamp. Without a timestep every timestep is merged like in
+        get_item_history.
+        """
+        where, parameters = DbManager.__history_filter(item_ids, timestep, start, end)
+        columns = f"{_HISTORY_ID}, {_DATE}, {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL}"
+        if timestep is not None:
+            return self.__db_cur.execute(f"""
+                                         SELECT {columns}
+                                         FROM {_HISTORY_TABLE}
+                                         {where}
+                                         ORDER BY {_HISTORY_ID}, {_DATE}""",
+                                         parameters).fetchall()
+        rows = self.__db_cur.execute(f"""
+                                     SELECT {columns}, MIN({_TIMESTEP})
+                                     FROM {_HISTORY_TABLE}
+                                     {where}
+                                     GROUP BY {_HISTORY_ID}, {_DATE}
+                                     ORDER BY {_HISTORY_ID}, {_DATE}""", parameters).fetchall()
+        return [row[:6] for row in rows]
+
+    def iter_history_rows(self, batch_size: int, item_ids: list[int] = None,
+                          timestep: int = None, start: int = None,
+                          end: int = None) -> Iterator[list[tuple]]:
+        """
+        Yield stored history rows (item id, timestep, timestamp, avgHighPrice,
+        avgLowPrice, highPriceVolume, lowPriceVolume) in lists of at most
+        batch_size rows, ordered like the table so nothing is sorted or held
+        in memory. Uses its own cursor so other queries can run in between.
+        """
+        where, parameters = DbManager.__history_filter(item_ids, timestep, start, end)
+        cursor = self.__db_conn.execute(f"""
+                                        SELECT {_HISTORY_ID}, {_TIMESTEP}, {_DATE},
+                                               {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL}
+                                        FROM {_HISTORY_TABLE}
+                                        {where}
+                                        ORDER BY {_HISTORY_ID}, {_TIMESTEP}, {_DATE}""",
+                                        parameters)
+        try:
+            while (rows := cursor.fetchmany(batch_size)):
+                yield rows
+        finally:
+            cursor.close()
+
+    def aggregate_history(self, window: int, timestep: int, item_ids: list[int] = None,
+                          start: int = None, end: int = None, rolling: int = None) -> list[tuple]:
+        """
+        Aggregate the stored history of one timestep into buckets of window
+        seconds (aligned to UNIX time) inside SQLite. Returns rows of
+        (item id, bucket, open, high, low, close, vwap, volume, spread) and a
+        trailing rolling spread if rolling is given, ordered by item and bucket.
+
+        open and close are the first and last mid prices of the bucket, high
+        is the highest avgHighPrice, low the lowest avgLowPrice, vwap the
+        volume weighted price of every trade, volume the number of traded
+        items, spread the mean avgHighPrice - avgLowPrice and the rolling
+        spread the mean spread of the last rolling buckets.
+        """
+        window = int(window)
+        if window <= 0 or window % timestep:
+            raise ValueError('window must be a positive multiple of the timestep')
+        where, parameters = DbManager.__history_filter(item_ids, timestep, start, end)
+        rolling_spread = ''
+        if rolling is not None:
+            if int(rolling) < 1:
+                raise ValueError('rolling must be at least 1 bucket')
+            rolling_spread = f""",
+                AVG(AVG(spread)) OVER (PARTITION BY item ORDER BY bucket
+                                       ROWS BETWEEN {int(rolling) - 1} PRECEDING AND CURRENT ROW)"""
+        return self.__db_cur.execute(f"""
+            WITH points AS (
+                SELECT {_HISTORY_ID} AS item,
+                       {_DATE} - {_DATE} % {window} AS bucket,
+                       {_DATE} AS ts,
+                       (COALESCE({_AVG_HIGH}, {_AVG_LOW})
+                        + COALESCE({_AVG_LOW}, {_AVG_HIGH})) / 2.0 AS price,
+                       COALESCE({_AVG_HIGH}, {_AVG_LOW}) AS high_price,
+                       COALESCE({_AVG_LOW}, {_AVG_HIGH}) AS low_price,
+                       {_AVG_HIGH} - {_AVG_LOW} AS spread,
+                       COALESCE({_AVG_HIGH}, 0) * {_HIGH_VOL}
+                       + COALESCE({_AVG_LOW}, 0) * {_LOW_VOL} AS turnover,
+                       {_HIGH_VOL} + {_LOW_VOL} AS volume
+                FROM {_HISTORY_TABLE}
+                {where}),
+            candles AS (
+                SELECT item, bucket, high_price, low_price, spread, turnover, volume,
+                       FIRST_VALUE(price) OVER bucket_rows AS open,
+                       LAST_VALUE(price) OVER bucket_rows AS close
+                FROM points
+                WHERE price IS NOT NULL
+                WINDOW bucket_rows AS (PARTITION BY item, bucket ORDER BY ts
+                                       ROWS BETWEEN UNBOUNDED PRECEDING
+                                       AND UNBOUNDED FOLLOWING))
+            SELECT item, bucket, MIN(open), MAX(high_price), MIN(low_price), MIN(close),
+                   SUM(turnover) * 1.0 / NULLIF(SUM(volume), 0), SUM(volume),
+                   AVG(spread){rolling_spread}
+            FROM candles
+            GROUP BY item, bucket
+            ORDER BY item, bucket""", parameters).fetchall()
+
+    def compact_history(self, policy: list[tuple[int, int | None]], now: float,
+                        vacuum: bool = False) -> dict[str, int]:
+        """
+        Roll history older than its retention up into the next coarser timestep.
+
+        policy lists (timestep, retention) from the finest to the coarsest
+        timestep, both in seconds, a retention of None keeps a timestep forever.
+        Rows of a timestep in whole coarser buckets older than its retention are
+        merged into one row per coarser bucket with volume weighted average
+        prices and summed volumes, unless that bucket is already stored, and
+        then deleted. Only rows that aged past their retention since the last
+        run are read, every batch of items is its own transaction.
+        The freed pages are returned to the file system, vacuum rebuilds the
+        whole database which also enables this for databases made by older versions.
+        Returns the number of rolled up and deleted rows.
+        """
+        summary = {'rolled_up': 0, 'deleted': 0}
+        for (fine, retention), (coarse, _) in zip(policy, policy[1:]):
+            if retention is None:
+                continue
+            cutoff = int((now - retention) // coarse * coarse)
+            item_ids = [row[0] for row in self.__db_cur.execute(f"""
+                        SELECT DISTINCT {_HISTORY_ID}
+                        FROM {_HISTORY_TABLE}
+                        WHERE {_TIMESTEP}=? AND {_DATE}<?""", (fine, cutoff)).fetchall()]
+            for batch in range(0, len(item_ids), _COMPACT_BATCH):
+                where, parameters = DbManager.__history_filter(
+                    item_ids[batch:batch + _COMPACT_BATCH], fine, end=cutoff - 1)
+                with self.transaction():
+                    changes = self.__db_conn.total_changes
+                    self.__db_cur.execute(f"""
+                        INSERT OR IGNORE INTO {_HISTORY_TABLE} (
+                          {_HISTORY_ID}, {_TIMESTEP}, {_DATE},
+                          {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL})
+                        SELECT {_HISTORY_ID}, {coarse}, {_DATE} - {_DATE} % {coarse},
+                               CAST(ROUND(SUM({_AVG_HIGH} * {_HIGH_VOL}) * 1.0 / NULLIF(SUM(
+                                 CASE WHEN {_AVG_HIGH} IS NOT NULL THEN {_HIGH_VOL} END), 0))
+                                 AS INTEGER),
+                               CAST(ROUND(SUM({_AVG_LOW} * {_LOW_VOL}) * 1.0 / NULLIF(SUM(
+                                 CASE WHEN {_AVG_LOW} IS NOT NULL THEN {_LOW_VOL} END), 0))
+                                 AS INTEGER),
+                               SUM({_HIGH_VOL}), SUM({_LOW_VOL})
+                        FROM {_HISTORY_TABLE}
+                        {where}
+                        GROUP BY {_HISTORY_ID}, {_DATE} - {_DATE} % {coarse}""", parameters)
+                    summary['rolled_up'] += self.__db_conn.total_changes - changes
+                    self.__db_cur.execute(f"DELETE FROM {_HISTORY_TABLE} {where}", parameters)
+                    summary['deleted'] += self.__db_cur.rowcount
+        if vacuum:
+            self.__db_cur.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            self.__db_cur.execute('VACUUM')
+        else:
+            self.__db_cur.execute('PRAGMA incremental_vacuum').fetchall()
+        return summary
+
+    def migrate_item_tables(self) -> int:
+        """
+        Move history from the legacy per item tables (item<id>) into the
+        history table and drop them. The legacy tables merged every timestep,
+        finer ones first, so a timestamp aligned to a day may hold 5m or 1h
+        history. Each row is assigned the widest timestep its timestamp is
+        aligned to that is no wider than the gap to its nearest neighbouring
+        row, rows without neighbours the widest aligned timestep.
+        Each table is migrated in its own transaction so an interrupted
+        migration can simply be run again.
+        Returns the number of migrated tables.
+        """
+        legacy_tables = [row[0] for row in self.__db_cur.execute("""
+                                                                SELECT name
+                                                                FROM sqlite_master
+                                                                WHERE type='table'
+                                                                AND name GLOB 'item[0-9]*'
+                                                                """).fetchall()]
+        widest = max(_TIMESTEP_SECONDS.values())
+        timestep_case = ' '.join(f'WHEN ts % {seconds} = 0 AND gap >= {seconds} THEN {seconds}'
+                                 for seconds in sorted(_TIMESTEP_SECONDS.values(), reverse=True))
+        for table in legacy_tables:
+            with self.transaction():
+                self.__db_cur.execute(f"""
+                                      INSERT OR IGNORE INTO {_HISTORY_TABLE} (
+                                        {_HISTORY_ID}, {_TIMESTEP}, {_DATE},
+                                        {_AVG_HIGH}, {_AVG_LOW}, {_HIGH_VOL}, {_LOW_VOL})
+                                      SELECT {int(table[len('item'):])},
+                                             CASE {timestep_case}
+                                             ELSE {min(_TIMESTEP_SECONDS.values())} END,
+                                             ts, high, low, high_volume, low_volume
+                                      FROM (
+                                        SELECT ts, high, low, high_volume, low_volume,
+                                               MIN(COALESCE(ts - LAG(ts) OVER w, {widest}),
+                                                   COALESCE(LEAD(ts) OVER w - ts, {widest}))
+                                                 AS gap
+                                        FROM (
+                                          SELECT CAST({_DATE} AS INTEGER) AS ts,
+                                                 CAST({_AVG_HIGH} AS INTEGER) AS high,
+                                                 CAST({_AVG_LOW} AS INTEGER) AS low,
+                                                 COALESCE(CAST({_HIGH_VOL} AS INTEGER), 0)
+                                                   AS high_volume,
+                                                 COALESCE(CAST({_LOW_VOL} AS INTEGER), 0)
+                                                   AS low_volume
+                                          FROM {table})
+                                        WINDOW w AS (ORDER BY ts))""")
+                self.__db_cur.execute(f"""DROP TABLE {table}""")
+        return len(legacy_tables)
 
     @staticmethod
     def id_to_tablename(item_id: int):
@@ -7,17 +7,24 @@ Copyright (C) 2022 moxxos
 from io import BytesIO
 from PIL import Image
 
-import requests
 from climage import climage
 
+from gppc._http import _get
+
 _SM_IMG_SIZE = 7
 _LG_IMG_SIZE = 9
 
 
-def _get_item_pic(pic_link: str, size: int) -> str:
-    pic_req = requests.get(pic_link, headers={'user-agent': 'Mozilla/5.0'},
-                           timeout=100)
-    item_gif = Image.open(BytesIO(pic_req.content))
+def _fetch_icon(pic_link: str) -> bytes:
+    """Download the raw bytes of an item picture."""
+    pic_req = _get(pic_link, headers={'user-agent': 'Mozilla/5.0'})
+    pic_req.raise_for_status()
+    return pic_req.content
+
+
+def _render_icon(icon: bytes, size: int) -> str:
+    """Render raw item picture bytes as an ANSI terminal image of the given width."""
+    item_gif = Image.open(BytesIO(icon))
     item_alpha = item_gif.convert('RGBA').getchannel('A')
     item_jpg = Image.new('RGBA', item_gif.size, (0, 0, 0, 255))
     item_jpg.paste(item_gif, mask=item_alpha)
@@ -30,6 +37,15 @@ def _get_item_pic(pic_link: str, size: int) -> str:
     return item_pic
 
 
+def _blank_icon(size: int) -> str:
+    """Return blank picture lines to print in place of a picture that could not be loaded."""
+    return (' ' * size + '\n') * max(3, size // 2)
+
+
+def _get_item_pic(pic_link: str, size: int) -> str:
+    return _render_icon(_fetch_icon(pic_link), size)
+
+
 def _print_item_simple(item: str, price: str, change: str, item_url, sm_img: str) -> None:
     newline_1 = sm_img.find('\n')
     newline_2 = sm_img[newline_1 + 1:].find('\n') + newline_1 + 1
@@ -0,0 +1,184 @@
+"""
+Implements columnar export of stored history to Arrow and Parquet files.
+
+The history table is streamed out of SQLite in batches into a hive
+partitioned dataset in the data directory, partitioned by month or by item.
+Arrow (IPC) files are uncompressed and read back memory-mapped without
+copying, Parquet files are smaller but decoded on read. Reads only open the
+partitions a time range or item list can match and only the requested columns.
+pyarrow is an optional dependency: pip install gppc[parquet]
+
+Copyright (C) 2022 moxxos
+"""
+
+import os
+import shutil
+
+import pandas
+
+from gppc._db import _get_db, _appdata_path
+from gppc._frame import _HISTORY_DTYPES, _unix_seconds
+from gppc._item import _timestep_seconds
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.dataset
+    import pyarrow.fs
+except ImportError:
+    pyarrow = None
+
+_EXPORT_DIR = 'history'
+_EXPORT_BATCH = 100_000  # rows read from SQLite per record batch
+_FORMATS = {'arrow': 'ipc', 'parquet': 'parquet'}
+_PARTITIONS = ('month', 'item')
+_ITEM_ID = 'item_id'
+_TIMESTEP = 'timestep'
+_DATE = 'timestamp'
+_MONTH = 'month'
+_MARKER = '.gppc_export'  # marks a directory written by export_history, ignored on read
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for columnar history, '
+                          'install it with: pip install gppc[parquet]')
+
+
+def _schema():
+    return pyarrow.schema([(_ITEM_ID, pyarrow.int32()),
+                           (_TIMESTEP, pyarrow.int32()),
+                           (_DATE, pyarrow.timestamp('s', tz='UTC')),
+                           ('avgHighPrice', pyarrow.int32()),
+                           ('avgLowPrice', pyarrow.int32()),
+                           ('highPriceVolume', pyarrow.uint32()),
+                           ('lowPriceVolume', pyarrow.uint32())])
+
+
+def _export_path(path: str | None, file_format: str) -> str:
+    if file_format not in _FORMATS:
+        raise ValueError('file_format must be one of: ' + str(list(_FORMATS)))
+    return path if path else os.path.join(_appdata_path(), _EXPORT_DIR + '_' + file_format)
+
+
+def _record_batches(schema, partition: str):
+    """Stream the history table as record batches with the partition column added."""
+    for rows in _get_db().iter_history_rows(_EXPORT_BATCH):
+        arrays = []
+        for values, field in zip(zip(*rows), schema):
+            if field.name == _DATE:
+                # UNIX seconds are cast, not converted, to Arrow timestamps
+                arrays.append(pyarrow.array(values, type=pyarrow.int64()).cast(field.type))
+            else:
+                arrays.append(pyarrow.array(values, type=field.type))
+        if partition == 'month':
+            arrays.append(pyarrow.compute.strftime(arrays[schema.get_field_index(_DATE)],
+                                                   format='%Y-%m'))
+        yield pyarrow.RecordBatch.from_arrays(arrays, schema=_partitioned_schema(partition))
+
+
+def _month(unix_seconds: int) -> str:
+    return pandas.Timestamp(unix_seconds, unit='s', tz='UTC').strftime('%Y-%m')
+
+
+def _partitioned_schema(partition: str):
+    schema = _schema()
+    if partition == 'month':
+        return schema.append(pyarrow.field(_MONTH, pyarrow.string()))
+    return schema
+
+
+def _clear_export(path: str) -> None:
+    """Delete an earlier export at path, refusing to touch any other non empty directory."""
+    if not os.path.exists(path):
+        return
+    if os.path.isfile(os.path.join(path, _MARKER)):
+        shutil.rmtree(path)
+    elif not os.path.isdir(path) or os.listdir(path):
+        raise ValueError(path + ' exists and is not a history export, choose an empty directory')
+
+
+def export_history(path: str = None, partition: str = 'month', file_format: str = 'arrow') -> str:
+    """
+    Write every stored history row to a partitioned columnar dataset,
+    replacing an earlier export at the same path. Only directories written
+    by export_history or empty ones are replaced.
+
+    :param path: dataset directory, history_<file_format> in the gppc data directory by default
+    :param partition: 'month' (month=YYYY-MM directories) or 'item' (item_id=<id> directories)
+    :param file_format: 'arrow' for uncompressed memory-mapped reads or 'parquet' for small files
+    :return: the dataset directory
+    """
+    _require_pyarrow()
+    if partition not in _PARTITIONS:
+        raise ValueError('partition must be one of: ' + str(list(_PARTITIONS)))
+    path = _export_path(path, file_format)
+    _clear_export(path)
+    schema = _partitioned_schema(partition)
+    pyarrow.dataset.write_dataset(_record_batches(_schema(), partition), path,
+                                  schema=schema,
+                                  format=_FORMATS[file_format],
+                                  partitioning=[_MONTH if partition == 'month' else _ITEM_ID],
+                                  partitioning_flavor='hive',
+                                  existing_data_behavior='overwrite_or_ignore')
+    with open(os.path.join(path, _MARKER), 'w', encoding='utf-8'):
+        pass
+    return path
+
+
+def read_history(path: str = None, columns: list[str] = None, item_ids: list[int] = None,
+                 timestep: str = None, start=None, end=None, file_format: str = 'arrow',
+                 arrow: bool = False):
+    """
+    Read exported history, opening only the partitions and columns needed.
+    Arrow datasets are memory-mapped. Only arrow=True without item_ids,
+    timestep, start or end returns a table referencing the mapped files
+    without copying, filters copy the matching rows and the DataFrame
+    returned by default is always a copy.
+
+    :param path: dataset directory, see export_history
+    :param columns: columns to read, every history column by default
+    :param item_ids: only read these items
+    :param timestep: only read this timestep, an API ('5m') or Item ('1day') timestep
+    :param start: first timestamp, a UNIX time, datetime or date string (UTC if naive)
+    :param end: last timestamp, inclusive
+    :param arrow: return a pyarrow.Table instead of a DataFrame
+    """
+    _require_pyarrow()
+    dataset = pyarrow.dataset.dataset(_export_path(path, file_format),
+                                      format=_FORMATS[file_format],
+                                      partitioning='hive',
+                                      filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True))
+    field = pyarrow.dataset.field
+    conditions = []
+    if item_ids is not None:
+        conditions.append(field(_ITEM_ID).isin(pyarrow.array(item_ids, type=pyarrow.int32())))
+    if (seconds := _timestep_seconds(timestep)) is not None:
+        conditions.append(field(_TIMESTEP) == seconds)
+    start, end = _unix_seconds(start), _unix_seconds(end)
+    # month directories outside the range are pruned without being opened
+    prune_months = _MONTH in dataset.schema.names
+    if start is not None:
+        conditions.append(field(_DATE) >= pyarrow.scalar(start, type=_schema().field(_DATE).type))
+        if prune_months:
+            conditions.append(field(_MONTH) >= _month(start))
+    if end is not None:
+        conditions.append(field(_DATE) <= pyarrow.scalar(end, type=_schema().field(_DATE).type))
+        if prune_months:
+            conditions.append(field(_MONTH) <= _month(end))
+    condition = None
+    for expression in conditions:
+        condition = expression if condition is None else condition & expression
+    if columns is None:
+        columns = _schema().names
+    table = dataset.to_table(columns=columns, filter=condition)
+    date_type = _schema().field(_DATE).type
+    if _DATE in table.column_names and table.schema.field(_DATE).type != date_type:
+        # Parquet has no second timestamps and stores milliseconds, read both formats alike
+        table = table.set_column(table.schema.get_field_index(_DATE), _DATE,
+                                 table.column(_DATE).cast(date_type))
+    if arrow:
+        return table
+    history = table.to_pandas()
+    return history.astype({column: dtype for column, dtype in _HISTORY_DTYPES.items()
+                           if column in history})
@@ -0,0 +1,109 @@
+"""
+Implements construction of compact, typed history DataFrames.
+
+Copyright (C) 2022 moxxos
+"""
+
+import numbers
+
+import numpy
+import pandas
+
+_DATE = 'timestamp'
+_AVG_HIGH = 'avgHighPrice'
+_AVG_LOW = 'avgLowPrice'
+_HIGH_VOL = 'highPriceVolume'
+_LOW_VOL = 'lowPriceVolume'
+_HISTORY_COLUMNS = [_DATE, _AVG_HIGH, _AVG_LOW, _HIGH_VOL, _LOW_VOL]
+_ITEM = 'item'
+_PANEL_ID = 'item_id'
+# aggregated history, see gppc._db.DbManager.aggregate_history
+_CANDLE_COLUMNS = [_DATE, 'open', 'high', 'low', 'close', 'vwap', 'volume', 'spread']
+_ROLLING_SPREAD = 'rolling_spread'
+_CANDLE_DTYPES = {'volume': 'uint64'}  # a year of volume overflows 32 bits
+
+# GE item page history, see gppc._parser._parse_price_history
+_GE_DATE = 'Date'
+_GE_PRICE = 'Price'
+_GE_AVERAGE = 'Average'
+_GE_VOLUME = 'Volume'
+_GE_HISTORY_DTYPES = {_GE_PRICE: 'int32', _GE_AVERAGE: 'int32', _GE_VOLUME: 'UInt32'}
+
+# GE prices are capped at 2^31 - 1 and missing prices are kept as <NA>
+_HISTORY_DTYPES = {_AVG_HIGH: 'Int32', _AVG_LOW: 'Int32',
+                   _HIGH_VOL: 'uint32', _LOW_VOL: 'uint32'}
+
+
+def _history_frame(records: list, columns: list[str] = None,
+                   datetime_index: bool = False) -> pandas.DataFrame:
+    """
+    Build a history DataFrame from API records (dicts) or database rows (tuples).
+    UNIX timestamps become UTC datetime64 values and prices and volumes use
+    compact integer dtypes.
+
+    :param records: API records or rows ordered like columns
+    :param columns: column names of tuple rows, defaults to every history column
+    :param datetime_index: use the timestamp as a DatetimeIndex instead of a column
+    """
+    if records and isinstance(records[0], dict):
+        history = pandas.DataFrame.from_records(records)
+    else:
+        history = pandas.DataFrame.from_records(records, columns=(columns if columns
+                                                                  else _HISTORY_COLUMNS))
+    return _compact_history(history, datetime_index)
+
+
+def _compact_history(history: pandas.DataFrame,
+                     datetime_index: bool = False) -> pandas.DataFrame:
+    """Convert a history DataFrame with UNIX timestamps to compact dtypes in place."""
+    if _DATE in history:
+        history[_DATE] = pandas.to_datetime(history[_DATE], unit='s', utc=True)
+    history = history.astype({column: dtype for column, dtype in _HISTORY_DTYPES.items()
+                              if column in history})
+    if datetime_index and _DATE in history:
+        history = history.set_index(_DATE)
+    return history
+
+
+def _ge_history_frame(dates: list[str], prices: list[int], averages: list[int],
+                      volumes: list[int | None]) -> pandas.DataFrame:
+    """
+    Build the 180 day GE history DataFrame from parsed item page columns,
+    indexed by UTC date with compact integer dtypes and <NA> for missing volumes.
+    """
+    index = pandas.DatetimeIndex(pandas.to_datetime(dates, format='%Y-%m-%d', utc=True),
+                                 name=_GE_DATE)
+    return pandas.DataFrame({column: pandas.array(values, dtype=_GE_HISTORY_DTYPES[column])
+                             for column, values in ((_GE_PRICE, prices),
+                                                    (_GE_AVERAGE, averages),
+                                                    (_GE_VOLUME, volumes))},
+                            index=index)
+
+
+def _unix_seconds(value) -> int | None:
+    """Convert a UNIX time, datetime, date string or Timestamp to UNIX seconds, naive is UTC."""
+    if value is None or isinstance(value, numbers.Real):
+        # numpy integers and floats too, pandas would read them as nanoseconds
+        return None if value is None else int(value)
+    value = pandas.Timestamp(value)
+    if value.tzinfo is None:
+        value = value.tz_localize('UTC')
+    return int(value.timestamp())
+
+
+def _panel_frame(rows: list[tuple], names: dict[int, str],
+                 columns: list[str] = None) -> pandas.DataFrame:
+    """
+    Build a DataFrame of many items indexed by (item, timestamp) from rows of
+    (item id, timestamp, ...) named by columns, by default the history columns.
+    item is the item name looked up in names.
+    """
+    if columns is None:
+        history = _history_frame(rows, columns=[_PANEL_ID, *_HISTORY_COLUMNS])
+    else:
+        history = _history_frame(rows, columns=[_PANEL_ID, *columns]).astype(_CANDLE_DTYPES)
+    codes, ids = pandas.factorize(history.pop(_PANEL_ID))
+    items = numpy.array([names[item_id] for item_id in ids], dtype=object)[codes]
+    history.index = pandas.MultiIndex.from_arrays([items, history.pop(_DATE)],
+                                                  names=[_ITEM, _DATE])
+    return history
@@ -7,7 +7,10 @@ Copyright (C) 2022 moxxos
 
 # Standard Library
 import argparse
-from html.parser import HTMLParser
+import re
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
 
 # External Packages
 import requests
@@ -15,130 +18,27 @@ import requests
 # Package Modules
 from gppc.__version__ import __version__
 from gppc.__description__ import __short_description__
-from gppc._display import _print_item_simple, _print_item_full, _get_item_pic
-from gppc._db import DbManager
+from gppc._display import (_print_item_simple, _print_item_full, _fetch_icon, _render_icon,
+                           _blank_icon)
+from gppc._db import _get_db
+from gppc._http import _get
 from gppc._constant import (_MAIN_URL,
                             _ITEM_PATH,
                             _SEARCH_PATH,
                             _POST_PARAMETER,
-                            _REQUEST_HEADER,
                             _SM_IMG_SIZE,
                             _LG_IMG_SIZE)
-from gppc._item import Item
+from gppc._index import _get_index
+from gppc._parser import _parse_search_page as _parse_page
+from gppc._search import _iter_local_search
+from gppc._retention import compact_history
 
 # Calculated constants
 _MAIN_URL_LEN = len(_MAIN_URL)
 _ITEM_PATH_LEN = len(_ITEM_PATH)
-
-
-class _SearchPageParser(HTMLParser):
-    """
-    Returns an HTML parser that digests a search page and stores an array of
-    6-tuples depending on number of items found:
-    item_data = [(item_name, item_id, item_price,
-                 item_change, item_url, item_pic)]
-    """
-
-    def __init__(self, item: str, page='1') -> None:
-        super().__init__()
-        self.__item = item
-        self.__page = page
-        self.__item_data = []
-        self.__data = ''
-        self.__item_name = ''
-        self.__item_id = ''
-        self.__item_price = ''
-        self.__item_pic = ''
-        self.__item_link = ''
-        self.__in_results_table = False
-        self.__item_row = False
-        self.__in_page_list = False
-        self.__td_counter = 0
-
-    def handle_starttag(self, tag: str,
-                        attrs: list[tuple[str, str | None]]) -> None:
-        """
-        attrs example: [('class', 'table-item-link'), ('href', 'https://...')]
-
-        A single item row should look like the following:
-        <tr>
-            <td><a href=item_link/ title=item_name><img/></td>
-            <td class='memberItem'></td> or <td class=''></td> for non-member
-            <td>item_price</td>
-            <td>item_change</td>
-        </tr>
-        """
-        if tag == 'a':
-            if (self.__item_row
-                and not self.__item_id
-                and 'href' in
-                (attr_keys := list(
-                    map(lambda attr_tuple: attr_tuple[0], attrs)))
-                    and 'title' in attr_keys):
-                href_pos = attr_keys.index('href')
-                self.__item_name = attrs[attr_keys.index('title')][1]
-                self.__item_link = attrs[href_pos][1]
-                item_path_pos = self.__item_link.find(_ITEM_PATH)
-                self.__item_id = self.__item_link[(
-                    item_path_pos + _ITEM_PATH_LEN + 1):]
-
-        if (tag == 'table' and ('class', 'results-table') in attrs):
-            self.__in_results_table = True
-
-        if (self.__in_results_table and tag == 'tr'):
-            self.__item_row = True
-            self.__td_counter = 0
-            self.__item_id = ''
-
-        if (tag == 'div'
-                and ('class', 'paging') in attrs):
-            self.__in_page_list = True
-
-    def handle_endtag(self, tag: str) -> None:
-
-        if tag == 'td':
-            if self.__td_counter == 1:
-                # TODO extract and display members data
-                None
-            elif self.__td_counter == 2:
-                self.__item_price = self.__data
-            elif self.__td_counter == 3:
-                # self.__data is item_change on last td tag
-                self.__item_data.append((self.__item_name, self.__item_id,
-                                        self.__item_price, self.__data,
-                                        self.__item_link, self.__item_pic))
-            self.__td_counter += 1
-
-        if (tag == 'table' and self.__in_results_table):
-            self.__in_results_table = False
-
-        if (tag == 'a' and self.__in_page_list):
-            try:
-                if int(self.__data) == int(self.__page) + 1:
-                    next_page_parser = _SearchPageParser(self.__item,
-                                                         self.__data)
-                    next_page = _request_search_page(self.__item, self.__data)
-                    next_page_parser.feed(next_page.text)
-                    self.__item_data = [*self.__item_data,
-                                        *next_page_parser.get_search_data()]
-            except ValueError:
-                return
-        if (self.__in_page_list and tag == 'div'):
-            self.__in_page_list = False
-
-    def handle_startendtag(self, tag: str,
-                           attrs: list[tuple[str, str | None]]) -> None:
-        if (tag == 'img' and 'src' and 'title'
-            in (attr_keys := list(map(lambda attr_tuple: attr_tuple[0], attrs)))
-                and attrs[attr_keys.index('title')][1] == self.__item_name):
-            self.__item_pic = attrs[attr_keys.index('src')][1]
-
-    def handle_data(self, data: str) -> None:
-        self.__data = data
-
-    def get_search_data(self) -> list[tuple[str, str, str, str, str, str]]:
-        """Return search data."""
-        return self.__item_data
+_SEARCH_WORKERS = 4  # search pages fetched at once
+_PIC_WORKERS = 8  # item pictures fetched at once
+_ICON_PREFIX = re.compile(r'^\d+_')  # cache busting number of picture links
 
 
 def _request_search_page(item: str, page='') -> requests.Response:
@@ -152,13 +52,68 @@ def _request_search_page(item: str, page='') -> requests.Response:
         _POST_PARAMETER: item,
         'page': page
     }
-    return requests.get(
-        _MAIN_URL + _SEARCH_PATH,
-        headers=_REQUEST_HEADER,
-        params=params, timeout=100)
+    return _get(_MAIN_URL + _SEARCH_PATH, params=params)
+
+
+def _parse_search_page(item: str, page: int) -> tuple[list, int]:
+    """
+    Fetch and parse one search page.
+    Returns the page's items and the highest page number it links to.
+    """
+    search_page = _request_search_page(item, str(page) if page > 1 else '')
+    item_data, page_count = _parse_page(search_page.text)
+    return item_data, max(page, page_count)
+
+
+def _iter_search_item_data(item: str, max_pages: int = None, max_results: int = None
+                           ) -> Iterator[tuple[str, str, str, str, str, str]]:
+    """
+    Search for an item, yielding each found item as soon as its page is parsed.
+    Items are yielded as 6-tuples:
+    (item_name, item_id, item_price, item_change, item_url, item_pic_link)
 
+    The page count is read from the first page and the remaining pages are
+    fetched concurrently, items keep the order of the pages.
 
-def _search_item_data(item: str) -> list[tuple[str, str, str, str, str, str]]:
+    :param item: required searchable item
+    :type item: str
+    :param max_pages: stop after this many pages
+    :param max_results: stop once this many items were found
+    """
+    item_data, page_count = _parse_search_page(item, 1)
+    page_size = len(item_data)
+    found = 0
+    for row in item_data[:max_results]:
+        found += 1
+        yield row
+    next_page = 2
+    executor = ThreadPoolExecutor(max_workers=_SEARCH_WORKERS)
+    try:
+        # pages may link further than the first page did, keep going until none are new
+        while next_page <= (last_page := min(page_count, max_pages if max_pages else page_count)):
+            if max_results is not None:
+                if found >= max_results or not page_size:
+                    return
+                # only request the pages that can still be needed
+                last_page = min(last_page, next_page - 1 + -(-(max_results - found) // page_size))
+            futures = [executor.submit(_parse_search_page, item, page)
+                       for page in range(next_page, last_page + 1)]
+            next_page = last_page + 1
+            for future in futures:
+                page_data, linked_pages = future.result()
+                page_count = max(page_count, linked_pages)
+                for row in page_data:
+                    if max_results is not None and found >= max_results:
+                        return
+                    found += 1
+                    yield row
+    finally:
+        # the caller may stop early, drop pages that have not been requested yet
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _search_item_data(item: str, max_pages: int = None,
+                      max_results: int = None) -> list[tuple[str, str, str, str, str, str]]:
     """
     Search for an item.
     Returns list of items found in a 6-tuple:
@@ -166,13 +121,39 @@ def _search_item_data(item: str) -> list[tuple[str, str, str, str, str, str]]:
 
     :param item: required searchable item
     :type item: str
+    :param max_pages: stop after this many pages
+    :param max_results: stop once this many items were found
     :return: the list of found items
     :rtype: list[tuple[str, str, str, str, str, str]]
     """
-    search_page = _request_search_page(item)
-    search_parser = _SearchPageParser(item)
-    search_parser.feed(search_page.text)
-    return search_parser.get_search_data()
+    return list(_iter_search_item_data(item, max_pages, max_results))
+
+
+def _iter_results(item: str, max_results: int = None, online: bool = False
+                  ) -> Iterator[tuple[str, str, str, str, str, str]]:
+    """
+    Search the local item mapping, falling back to the Grand Exchange search
+    when nothing matches or no price of the matches is known. Without network
+    the unpriced local matches are returned.
+
+    :param online: always search the Grand Exchange
+    """
+    if online:
+        yield from _iter_search_item_data(item, max_results=max_results)
+        return
+    item_data = list(_iter_local_search(item, max_results))
+    if any(row[2] != '-' or row[3] != '-' for row in item_data):
+        yield from item_data
+        return
+    found = False
+    try:
+        for row in _iter_search_item_data(item, max_results=max_results):
+            found = True
+            yield row
+    except requests.RequestException:
+        if found or not item_data:
+            raise
+        yield from item_data
 
 
 def _command_line_parser(item_argument: str) -> argparse.ArgumentParser:
@@ -189,7 +170,7 @@ def _command_line_parser(item_argument: str) -> argparse.ArgumentParser:
         item_argument,
         metavar='I',
         type=str,
-        nargs='+',
+        nargs='*',
         help='snake case or quoted item(s) (ex: gold_bar or \'gold bar\')'
     )
     parser.add_argument(
@@ -197,6 +178,21 @@ def _command_line_parser(item_argument: str) -> argparse.ArgumentParser:
         action='store_true',
         help='display full price and item information'
     )
+    parser.add_argument(
+        '--online', '-o',
+        action='store_true',
+        help='search the Grand Exchange website instead of the local item list'
+    )
+    parser.add_argument(
+        '--migrate',
+        action='store_true',
+        help='move history saved by older versions into the current cache format'
+    )
+    parser.add_argument(
+        '--compact',
+        action='store_true',
+        help='roll saved history past its retention up into coarser timesteps'
+    )
     return parser
 
 
@@ -205,33 +201,101 @@ def _main() -> None:
     item_argument = 'item(s)'
     parser = _command_line_parser(item_argument)
     args = vars(parser.parse_args())
+    if args['migrate']:
+        print(str(_get_db().migrate_item_tables()) + ' item tables migrated')
+    if args['compact']:
+        summary = compact_history()
+        print(str(summary['deleted']) + ' history rows rolled up into '
+              + str(summary['rolled_up']) + ' new rows')
+    if not (args['migrate'] or args['compact'] or args[item_argument]):
+        parser.error('the following arguments are required: I')
     for item in args[item_argument]:
         item = item.replace('_', ' ')
-        _search_print(item, args['full'])
+        _search_print(item, args['full'], online=args['online'])
 
 
 if __name__ == "__main__":
     _main()
 
 
-def _search_print(item, full=False) -> None:
-    """Preform search"""
-    DbMan = DbManager()
-    for item_data in _search_item_data(item):
-        try:
-            if DbMan.retrieve_item_info(item_data[1]) is None:
-                item_img = _get_item_pic(item_data[5], (_SM_IMG_SIZE if not full else _LG_IMG_SIZE))
-                item = Item(item_data[0])
-                DbMan.store_item_info(item._Item__info, item_img)
-            else:
-                item_img = DbMan.retrieve_item_info(int(item_data[1]))[9]
-
-            if full:
-                _print_item_full(item_data[0], item_data[2],
-                                 item_data[3], item_data[4], item_img)
-            else:
-                _print_item_simple(item_data[0], item_data[2],
-                                   item_data[3], item_data[4], item_img)
-        except ValueError:
-            print(item_data[0] + ' not found in mapping.')
-    DbMan.close_db()
+def _search_print(item, full=False, max_results: int = None, online: bool = False) -> None:
+    """
+    Preform search, printing each item as soon as its page and picture are ready.
+    The local item list is searched unless online is set or it has no priced match.
+    Pictures are cached by file name and width, missing ones are downloaded
+    concurrently and a picture shared by several items is only downloaded once.
+    """
+    DbMan = _get_db()
+    img_size = _SM_IMG_SIZE if not full else _LG_IMG_SIZE
+    pending = deque()  # (item_data, icon key, future picture) in search order
+    icons = {}  # icon key -> future (downloaded picture or None, rendered picture or None, ANSI)
+    with ThreadPoolExecutor(max_workers=_PIC_WORKERS) as executor:
+        for item_data in _iter_results(item, max_results, online):
+            icon_key = _icon_key(item_data[5])
+            if (item_img := icons.get(icon_key)) is None:
+                if (ansi := DbMan.retrieve_icon_render(icon_key, img_size)) is not None:
+                    item_img = Future()
+                    item_img.set_result((None, None, ansi))
+                else:
+                    item_img = executor.submit(_load_icon, DbMan.retrieve_icon(icon_key),
+                                               item_data[5], img_size)
+                icons[icon_key] = item_img
+            pending.append((item_data, icon_key, item_img))
+            while pending and pending[0][2].done():
+                _print_search_row(DbMan, *pending.popleft(), img_size, full)
+        while pending:
+            _print_search_row(DbMan, *pending.popleft(), img_size, full)
+
+
+def _icon_key(pic_link: str) -> str:
+    """
+    Return the cache key of an item picture: its file name without the
+    cache busting number GE prefixes, e.g. obj_sprite.gif?id=556.
+    """
+    return _ICON_PREFIX.sub('', pic_link.rsplit('/', 1)[-1])
+
+
+def _load_icon(icon: bytes | None, pic_link: str,
+               size: int) -> tuple[bytes | None, str | None, str | None]:
+    """
+    Render a cached picture, downloading it first if it is not cached.
+    Returns (downloaded picture or None, rendered picture, rendered picture),
+    without network nothing is cached and the rendered picture is None.
+    """
+    if icon is not None:
+        ansi = _render_icon(icon, size)
+        return None, ansi, ansi
+    try:
+        icon = _fetch_icon(pic_link)
+    except requests.RequestException:
+        return None, None, None
+    ansi = _render_icon(icon, size)
+    return icon, ansi, ansi
+
+
+def _print_search_row(DbMan, item_data: tuple, icon_key: str, item_img: Future,
+                      img_size: int, full: bool) -> None:
+    """Print a single search result, caching its info and picture if they are new."""
+    try:
+        icon, render, ansi = item_img.result()
+        if icon is not None:
+            DbMan.store_icon(icon_key, icon)
+        if render is not None:
+            DbMan.store_icon_render(icon_key, img_size, render)
+        if DbMan.retrieve_item_info(int(item_data[1])) is None:
+            if (item_info := _get_index().find(int(item_data[1]))) is None:
+                raise ValueError(item_data[0])
+            if ansi is not None:
+                DbMan.store_item_info(item_info, ansi)
+        if ansi is None:
+            # keep the row layout of the printers, they split the picture at its lines
+            ansi = _blank_icon(img_size)
+
+        if full:
+            _print_item_full(item_data[0], item_data[2],
+                             item_data[3], item_data[4], ansi)
+        else:
+            _print_item_simple(item_data[0], item_data[2],
+                               item_data[3], item_data[4], ansi)
+    except ValueError:
+        print(item_data[0] + ' not found in mapping.')
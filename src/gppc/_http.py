@@ -0,0 +1,153 @@
+"""
+Implements the shared HTTP transport used for every network request.
+
+Connections are pooled per host and kept alive, failed requests are retried
+with exponential backoff and every host is throttled by a token bucket.
+
+Copyright (C) 2022 moxxos
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from gppc._constant import (_REQUEST_HEADER,
+                            _CONNECT_TIMEOUT,
+                            _READ_TIMEOUT,
+                            _HTTP_RETRIES,
+                            _HTTP_BACKOFF,
+                            _HTTP_POOL_SIZE,
+                            _RATE_LIMITS,
+                            _DEFAULT_RATE_LIMIT)
+
+_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_config = {
+    'connect_timeout': _CONNECT_TIMEOUT,
+    'read_timeout': _READ_TIMEOUT,
+    'retries': _HTTP_RETRIES,
+    'backoff': _HTTP_BACKOFF,
+    'pool_size': _HTTP_POOL_SIZE,
+    'rate_limits': dict(_RATE_LIMITS)  # host -> (requests per second, burst)
+}
+_lock = threading.Lock()
+_transport = {'session': None, 'pid': None}
+_buckets = {}  # host -> _TokenBucket
+
+
+class _TokenBucket():
+    """Blocks callers so that a host sees at most rate requests per second."""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take a token, sleeping until one is available."""
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.__burst,
+                                    self.__tokens + (now - self.__last) * self.__rate)
+                self.__last = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.__rate
+            time.sleep(wait)
+
+
+def _new_session() -> requests.Session:
+    retry = Retry(total=_config['retries'],
+                  backoff_factor=_config['backoff'],
+                  status_forcelist=_RETRY_STATUS,
+                  allowed_methods=frozenset(['GET', 'HEAD']),
+                  respect_retry_after_header=True,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=_config['pool_size'],
+                          pool_maxsize=_config['pool_size'],
+                          max_retries=retry)
+    session = requests.Session()
+    session.headers.update(_REQUEST_HEADER)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _get_session() -> requests.Session:
+    """Return the process wide session, recreating it after a fork."""
+    if _transport['session'] is None or _transport['pid'] != os.getpid():
+        with _lock:
+            if _transport['session'] is None or _transport['pid'] != os.getpid():
+                _transport['session'] = _new_session()
+                _transport['pid'] = os.getpid()
+    return _transport['session']
+
+
+def _get_bucket(host: str) -> _TokenBucket:
+    if (bucket := _buckets.get(host)) is None:
+        with _lock:
+            if (bucket := _buckets.get(host)) is None:
+                rate, burst = _config['rate_limits'].get(host, _DEFAULT_RATE_LIMIT)
+                bucket = _buckets[host] = _TokenBucket(rate, burst)
+    return bucket
+
+
+def _throttle(url: str) -> None:
+    """Wait for a rate limit token of the host of url."""
+    _get_bucket(urlsplit(url).netloc).acquire()
+
+
+def _get(url: str, params: dict = None, headers: dict = None,
+         timeout: float | tuple[float, float] = None,
+         throttled: bool = False) -> requests.Response:
+    """
+    Send a rate limited GET request through the shared session.
+    Headers are merged over the default gppc request header.
+    Set throttled if the caller already took a token with _throttle.
+    """
+    if not throttled:
+        _throttle(url)
+    if timeout is None:
+        timeout = (_config['connect_timeout'], _config['read_timeout'])
+    return _get_session().get(url, params=params, headers=headers, timeout=timeout)
+
+
+def configure_transport(connect_timeout: float = None,
+                        read_timeout: float = None,
+                        retries: int = None,
+                        backoff: float = None,
+                        pool_size: int = None,
+                        rate_limits: dict[str, tuple[float, int]] = None) -> None:
+    """
+    Configure the shared HTTP transport.
+
+    :param connect_timeout: seconds to wait for a connection
+    :param read_timeout: seconds to wait for a response
+    :param retries: number of retries on connection errors and 429/5xx responses
+    :param backoff: exponential backoff factor between retries
+    :param pool_size: number of kept alive connections per host
+    :param rate_limits: host -> (requests per second, burst size)
+    """
+    with _lock:
+        for key, value in (('connect_timeout', connect_timeout),
+                           ('read_timeout', read_timeout),
+                           ('retries', retries),
+                           ('backoff', backoff),
+                           ('pool_size', pool_size)):
+            if value is not None:
+                _config[key] = value
+        if rate_limits is not None:
+            _config['rate_limits'].update(rate_limits)
+            _buckets.clear()
+        if _transport['session'] is not None:
+            _transport['session'].close()
+        _transport['session'] = None
@@ -0,0 +1,81 @@
+"""
+Implements constant time item lookups over the item mapping.
+
+Copyright (C) 2022 moxxos
+"""
+
+import numbers
+from bisect import bisect_left
+
+from gppc._mapping import _raw_list, _mapping_version
+
+
+def _fold(name: str) -> str:
+    """Normalise an item name for case insensitive lookups."""
+    return ' '.join(name.split()).casefold()
+
+
+class _ItemIndex():
+    """
+    Maps exact names, case folded names and ids to positions in the mapping.
+    Case folded names are also kept sorted for prefix lookups.
+    """
+
+    def __init__(self, raw_list: list[dict]) -> None:
+        self.__raw_list = raw_list
+        self.__by_name = {}  # exact name -> position in raw list
+        self.__by_folded = {}  # folded name -> position in raw list
+        self.__by_id = {}  # id -> position in raw list
+        for pos, item in enumerate(raw_list):
+            self.__by_name[item['name']] = pos
+            self.__by_folded.setdefault(_fold(item['name']), pos)
+            self.__by_id[item['id']] = pos
+        self.__sorted_folded = sorted(self.__by_folded)
+
+    def __len__(self) -> int:
+        return len(self.__raw_list)
+
+    def position(self, key: str | int) -> int | None:
+        """
+        Return the mapping position of an item name or id.
+        Exact names are preferred over case insensitive matches.
+        """
+        if isinstance(key, numbers.Integral):
+            # numpy integers too, e.g. ids taken from the mapping columns
+            return self.__by_id.get(int(key))
+        pos = self.__by_name.get(key)
+        if pos is None:
+            pos = self.__by_folded.get(_fold(key))
+        return pos
+
+    def find(self, key: str | int) -> dict | None:
+        """Return the mapping record of an item name or id."""
+        pos = self.position(key)
+        return None if pos is None else self.__raw_list[pos]
+
+    def record(self, pos: int) -> dict:
+        """Return the mapping record at a mapping position."""
+        return self.__raw_list[pos]
+
+    def prefix(self, prefix: str, limit: int = None) -> list[dict]:
+        """Return mapping records whose name starts with prefix, ignoring case."""
+        prefix = _fold(prefix)
+        records = []
+        for i in range(bisect_left(self.__sorted_folded, prefix), len(self.__sorted_folded)):
+            folded = self.__sorted_folded[i]
+            if not folded.startswith(prefix) or (limit is not None and len(records) >= limit):
+                break
+            records.append(self.__raw_list[self.__by_folded[folded]])
+        return records
+
+
+_index_cache = {'version': None, 'index': None}
+
+
+def _get_index() -> _ItemIndex:
+    """Return the item index, rebuilding it whenever the mapping changes."""
+    version = _mapping_version()
+    if _index_cache['version'] != version:
+        _index_cache['index'] = _ItemIndex(_raw_list())
+        _index_cache['version'] = version
+    return _index_cache['index']
@@ -4,112 +4,357 @@ Encapsulates all historical data of a single item.
 Copyright (C) 2022 moxxos
 """
 
-from datetime import datetime
-from html.parser import HTMLParser
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from collections.abc import Sequence
 from typing import Iterator
 
-import requests
+import numpy
 import pandas
+import requests
 
-from gppc._constant import _MAP_API, _ITEM_URL, _REQUEST_HEADER, _HISTORY_API, _TIMESTEP_PARAMETER
-from gppc._db import DbManager
+from gppc._constant import _ITEM_URL, _TIMESTEP_SECONDS, _SNAPSHOT_API
+from gppc._db import DbManager, _get_db, _HISTORY_CHUNK
 from gppc._display import _get_item_pic
+from gppc._frame import (_history_frame, _ge_history_frame, _panel_frame, _unix_seconds,
+                         _GE_PRICE, _GE_AVERAGE, _ITEM, _CANDLE_COLUMNS, _ROLLING_SPREAD)
+from gppc._http import _get
+from gppc._parser import _parse_item_page, _parse_price_history
+from gppc._index import _get_index
+from gppc._columns import _get_columns
+from gppc._source import _get_provider
+from gppc._cache import _get_history_cache, _bucket_end
 
-_RAW_LIST = requests.get(_MAP_API, headers=_REQUEST_HEADER, timeout=100).json()
-_NAME_LIST = list(map(lambda i: i['name'], _RAW_LIST))
-
-_VAR_PRICE = 'average180'
-_VAR_TRADE = 'trade180'
-_DATA_START = '.push([new Date(\''
-_DATA_END = '), '
-
-_PRICE_LEN = len(_VAR_PRICE)
-_TRADE_LEN = len(_VAR_TRADE)
-_DATA_START_LEN = len(_DATA_START)
-_DATA_END_LEN = len(_DATA_END)
 _TIMESTEP_MAP = {'1day': '5m', '2week': '1h', '3month': '6h', '1year': '24h'}
-
-ItemHistoryData = tuple[str, str, str, str]
-
-# temporary bool in place of giving user option between api and osrs ge site
-_TEMP_USE_API = True
-
-
-class Catalog(list):
-    """Represents a list of items."""
+_WRITE_BATCH = 100  # items stored per transaction by Catalog.save_history
+
+
+def _timestep_seconds(timestep: str | None) -> int | None:
+    """Return the width of an API ('5m') or Item ('1day') timestep in seconds."""
+    if timestep is None:
+        return None
+    timestep = _TIMESTEP_MAP.get(timestep, timestep)
+    if timestep not in _TIMESTEP_SECONDS:
+        raise ValueError('timestep must be one of: ' + str([*_TIMESTEP_SECONDS, *_TIMESTEP_MAP]))
+    return _TIMESTEP_SECONDS[timestep]
+
+
+def _aggregate(ids: list[int], names: list[str], window, timestep: str | None,
+               start, end, rolling: int | None) -> pandas.DataFrame:
+    if not isinstance(window, (int, float)):
+        window = pandas.Timedelta(window).total_seconds()
+    start, end = _unix_seconds(start), _unix_seconds(end)
+    if (width := _timestep_seconds(timestep)) is None:
+        fitting = sorted((seconds for seconds in _TIMESTEP_SECONDS.values()
+                          if not window % seconds), reverse=True)
+        if not fitting:
+            raise ValueError('window must be a multiple of a timestep: '
+                             + str(list(_TIMESTEP_SECONDS)))
+        # the widest timestep that fits the window and has rows in range, the least rows to read
+        width = next((seconds for seconds in fitting
+                      if _get_db().has_history(ids, seconds, start, end)), fitting[0])
+    rows = _get_db().aggregate_history(window, width, ids, start, end, rolling)
+    columns = _CANDLE_COLUMNS if rolling is None else [*_CANDLE_COLUMNS, _ROLLING_SPREAD]
+    return _panel_frame(rows, dict(zip(ids, names)), columns)
+
+
+class Catalog(Sequence):
+    """
+    Represents a list of items.
+    Items are kept as positions in the columnar item mapping and an Item is
+    only created the first time it is accessed.
+    """
 
     def __init__(self, *items) -> None:
-        self.__id_map = {}  # id -> name
-        self.__pos_map = {}  # name -> position in raw list
-        self.__item_map = []  # position in catalog to item
-        self.__name_map = {}  # name -> position in catalog
-        index = 0
-        for item_name in (items if items else _NAME_LIST):
-            try:
-                if items:
-                    item_name = item_name[0].capitalize() + item_name[1:]
-                self.__id_map.update(
-                    {(_id := _RAW_LIST[(pos := _NAME_LIST.index(item_name))])['id']: item_name})
-                self.__pos_map.update({item_name: pos})
-                self.__item_map.append(Item(item_name, pos))
-                self.__name_map.update({item_name: index})
-                # print("Successfully added: " + item_name)
-            except ValueError:
-                print(item_name + " was not found")
-            index += 1
-        # print(self.__id_map.values())
-        super().__init__(self.__id_map.values())
+        self.__columns = _get_columns()
+        if items:
+            positions = {}  # mapping position -> None, in the given order without duplicates
+            for item_key in items:
+                if (pos := self.__columns.position(item_key)) is None:
+                    print(str(item_key) + " was not found")
+                    continue
+                positions.setdefault(pos)
+            self.__positions = numpy.fromiter(positions, dtype=numpy.int32, count=len(positions))
+        else:
+            self.__positions = numpy.arange(len(self.__columns), dtype=numpy.int32)
+        self.__items = {}  # mapping position -> Item, filled on access
+        self.__lookup = None  # mapping position -> position in catalog, built on name lookup
+
+    @classmethod
+    def _from_positions(cls, columns, positions: numpy.ndarray, items: dict) -> 'Catalog':
+        """Create a catalog of mapping positions sharing already created Items."""
+        catalog = cls.__new__(cls)
+        catalog.__columns = columns
+        catalog.__positions = positions
+        catalog.__items = items
+        catalog.__lookup = None
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self.__positions)
+
+    def __item(self, pos: int) -> 'Item':
+        if (item := self.__items.get(pos)) is None:
+            item = self.__items[pos] = Item(int(self.__columns.ids[pos]))
+        return item
+
+    def __position(self, key) -> int | None:
+        """Return the catalog position of an item name, id or Item."""
+        if isinstance(key, Item):
+            key = key.id
+        if (pos := self.__columns.position(key)) is None:
+            return None
+        if self.__lookup is None:
+            self.__lookup = {}
+            for index, item_pos in enumerate(self.__positions.tolist()):
+                self.__lookup.setdefault(item_pos, index)
+        return self.__lookup.get(pos)
+
+    def __mapping_position(self, key) -> int:
+        if (pos := self.__columns.position(key.id if isinstance(key, Item) else key)) is None:
+            raise ValueError(str(key) + ' was not found')
+        return pos
+
+    def __set_positions(self, positions: numpy.ndarray) -> None:
+        # always a new array, slices of this catalog may share the old one
+        self.__positions = positions
+        self.__lookup = None
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            # return Item((item_name := super().__getitem__(key)), self.__pos_map[item_name])
-            return self.__item_map[key]
+        if isinstance(key, (int, numpy.integer)):
+            return self.__item(int(self.__positions[key]))
         if isinstance(key, slice):
-            start = 0
-            if key.start is not None:
-                start = key.start
-            stop = len(self.__id_map)
-            if key.stop is not None:
-                stop = key.stop
-            arr = []
-            for index in range(start, stop):
-                arr.append(super().__getitem__(index))
-            return Catalog(*arr)
-        return self.__item_map[self.__name_map[key]]
+            # a view of the positions, the catalogs share their Items
+            return Catalog._from_positions(self.__columns, self.__positions[key], self.__items)
+        if (index := self.__position(key)) is None:
+            raise KeyError(key)
+        return self.__item(int(self.__positions[index]))
+
+    def __contains__(self, key) -> bool:
+        return self.__position(key) is not None
 
     def __iter__(self) -> Iterator:
+        for pos in self.__positions.tolist():
+            yield self.__item(pos)
+
+    def __repr__(self) -> str:
+        return repr(self.names)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Catalog):
+            return self.ids == other.ids
+        if isinstance(other, list):
+            return self.names == other
+        return NotImplemented
+
+    __hash__ = None
+
+    # list methods, applied to the item names like the list Catalog used to be
+    def append(self, item) -> None:
+        self.insert(len(self), item)
+
+    def extend(self, items) -> None:
+        positions = [self.__mapping_position(item) for item in items]
+        self.__set_positions(numpy.concatenate(
+            (self.__positions, numpy.array(positions, dtype=numpy.int32))))
+
+    def insert(self, index: int, item) -> None:
+        index = min(max(index + len(self) if index < 0 else index, 0), len(self))
+        self.__set_positions(numpy.insert(self.__positions, index,
+                                          self.__mapping_position(item)))
+
+    def remove(self, item) -> None:
+        if (index := self.__position(item)) is None:
+            raise ValueError(str(item) + ' is not in the catalog')
+        del self[index]
+
+    def index(self, item, start: int = 0, stop: int = None) -> int:
+        pos = self.__mapping_position(item)
+        matches = numpy.flatnonzero(self.__positions[start:stop] == pos)
+        if not len(matches):
+            raise ValueError(str(item) + ' is not in the catalog')
+        return int(matches[0]) + (start + len(self) if start < 0 else start)
+
+    def count(self, item) -> int:
+        if (pos := self.__columns.position(item.id if isinstance(item, Item) else item)) is None:
+            return 0
+        return int(numpy.count_nonzero(self.__positions == pos))
+
+    def pop(self, index: int = -1) -> 'Item':
+        item = self[index]
+        del self[index]
+        return item
+
+    def __delitem__(self, key) -> None:
+        if not isinstance(key, (int, numpy.integer, slice)):
+            if (index := self.__position(key)) is None:
+                raise KeyError(key)
+            key = index
+        keep = numpy.ones(len(self), dtype=numpy.bool_)
+        keep[key] = False
+        self.__set_positions(self.__positions[keep])
+
+    def clear(self) -> None:
+        self.__set_positions(self.__positions[:0].copy())
+
+    def reverse(self) -> None:
+        self.__set_positions(self.__positions[::-1].copy())
+
+    def sort(self, key=None, reverse: bool = False) -> None:
+        """Sort the catalog in place by item name or by key applied to each name."""
+        names = self.names
+        order = sorted(range(len(names)), reverse=reverse,
+                       key=(lambda i: key(names[i])) if key else names.__getitem__)
+        self.__set_positions(self.__positions[numpy.array(order, dtype=numpy.intp)])
+
+    def where(self, **conditions) -> 'Catalog':
         """
-        for item_name in super().__iter__():
-            yield Item(item_name, self.__pos_map[item_name])
+        Return the items matching every condition as a new catalog, e.g.
+        catalog.where(members=False, limit__gte=10000, id__range=(500, 600)).
+
+        Conditions are attribute=value or attribute__operator=value with the
+        attributes id, members, limit, value, lowalch and highalch and the
+        operators eq (default), ne, lt, lte, gt, gte, in and range (inclusive).
+        attribute=None selects items without the attribute.
         """
-        for item in self.__item_map:
-            yield item
+        mask = numpy.ones(len(self.__positions), dtype=numpy.bool_)
+        for condition, value in conditions.items():
+            column, _, operator = condition.partition('__')
+            mask &= self.__columns.match(column, operator or 'eq', value, self.__positions)
+        return Catalog._from_positions(self.__columns, self.__positions[mask], self.__items)
+
+    @property
+    def names(self) -> list[str]:
+        return [self.__columns.names[pos] for pos in self.__positions.tolist()]
 
-    def save_history(self, timestep=None):
+    @property
+    def ids(self) -> list[int]:
+        return self.__columns.ids[self.__positions].tolist()
+
+    def save_history(self, timestep=None, workers: int = 1) -> dict[str, dict]:
+        """
+        Download and store the recent history of every item in the catalog.
+        Up to workers items are downloaded concurrently under the shared rate
+        limit while all database writes happen on the calling thread.
+        Returns item name -> {'success': bool, 'rows': int, 'error': str | None}.
+        """
         if timestep and timestep not in _TIMESTEP_MAP.keys():
             raise ValueError('timestep must be one of: ' + str(list(_TIMESTEP_MAP.keys())))
+        api_timesteps = [_TIMESTEP_MAP[timestep]] if timestep else list(_TIMESTEP_MAP.values())
+        return self.__save([(item, api_timesteps) for item in self], workers)
+
+    def sync(self, max_age: float | timedelta = None, workers: int = 1) -> dict[str, dict]:
+        """
+        Download and store only the timesteps of each item that are stale.
+        A timestep is stale when a newer bucket than the stored high-water
+        mark can exist and the last sync is older than max_age (defaults to
+        the bucket width). Items with nothing stale make no requests.
+        Returns the same summary as save_history.
+        """
+        sync_state = _get_db().get_sync_state(self.ids)
+        now = time.time()
+        plan = []
+        summary = {}
         for item in self:
-            if (timestep):
-                item._Item__get_recent_history(_TIMESTEP_MAP[timestep])
-                item.save_history(timestep)
+            if (stale := item._stale_timesteps(sync_state, max_age, now)):
+                plan.append((item, stale))
             else:
-                for ts in _TIMESTEP_MAP.values():
-                    item._Item__get_recent_history(ts)
-                item.save_history()
+                summary[item.name] = {'success': True, 'rows': 0, 'error': None}
+        summary.update(self.__save(plan, workers))
+        return {item.name: summary[item.name] for item in self}
+
+    def __save(self, plan: list[tuple['Item', list[str]]], workers: int) -> dict[str, dict]:
+        """Fetch (item, API timesteps) pairs concurrently and store them in batches."""
+        summary = {item.name: None for item, _ in plan}
+        db_man = _get_db()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(item._fetch_history, api_timesteps): (item, api_timesteps)
+                       for item, api_timesteps in plan}
+            done = []
+            for future in as_completed(futures):
+                done.append(future)
+                if len(done) >= _WRITE_BATCH:
+                    Catalog.__write_batch(db_man, futures, done, summary)
+                    done = []
+            Catalog.__write_batch(db_man, futures, done, summary)
+        return summary
+
+    def save_snapshot(self, endpoint: str = '5m', timestamp: int = None) -> int:
+        """
+        Store the whole market response of the wiki /latest, /5m or /1h endpoint
+        for every item in the catalog using one request and one transaction.
+        timestamp selects a past /5m or /1h bucket instead of the newest one.
+        Returns the number of new rows.
+        """
+        if endpoint not in _SNAPSHOT_API:
+            raise ValueError('endpoint must be one of: ' + str(list(_SNAPSHOT_API.keys())))
+        response = _get(_SNAPSHOT_API[endpoint],
+                        params=None if timestamp is None else {'timestamp': timestamp})
+        response.raise_for_status()
+        if endpoint == 'latest':
+            return _get_db().store_latest(response.json(), set(self.ids))
+        return _get_db().store_snapshot(response.json(), _TIMESTEP_SECONDS[endpoint],
+                                        set(self.ids))
+
+    def history(self, timestep: str = None, start=None, end=None) -> pandas.DataFrame:
+        """
+        Return the stored history of every item in the catalog from a single
+        database query, without downloading anything, indexed by (item, timestamp).
+        Use save_history or sync first to bring the stored history up to date.
+
+        :param timestep: '5m', '1h', '6h', '24h' or '1day', '2week', '3month', '1year',
+                         every timestep merged by default
+        :param start: first timestamp, a UNIX time, datetime or date string (UTC if naive)
+        :param end: last timestamp, inclusive
+        """
+        ids = self.ids
+        rows = _get_db().get_history_panel(ids, _timestep_seconds(timestep),
+                                           _unix_seconds(start), _unix_seconds(end))
+        return _panel_frame(rows, dict(zip(ids, self.names)))
+
+    def aggregate(self, window, timestep: str = None, start=None, end=None,
+                  rolling: int = None) -> pandas.DataFrame:
+        """
+        Aggregate the stored history of every item in the catalog into candles
+        inside the database, indexed by (item, timestamp) with the columns
+        open, high, low, close, vwap, volume, spread and rolling_spread if
+        rolling is given, see Item.aggregate.
+        """
+        return _aggregate(self.ids, self.names, window, timestep, start, end, rolling)
+
+    @staticmethod
+    def __write_batch(db_man: DbManager, futures: dict, done: list, summary: dict) -> None:
+        """Store the history of finished downloads in a single transaction."""
+        with db_man.transaction():
+            for future in done:
+                item, api_timesteps = futures[future]
+                try:
+                    missing = future.result()
+                    summary[item.name] = {
+                        'success': True,
+                        'rows': item._store_history(db_man, api_timesteps),
+                        'error': ('Missing API history data: ' + ', '.join(missing)
+                                  if missing else None)}
+                except (requests.RequestException, ValueError, KeyError) as error:
+                    summary[item.name] = {'success': False, 'rows': 0, 'error': str(error)}
 
 
 class Item():
     """Encapsulates all historical data of a single item."""
-
-    def __init__(self, item_name: str, _raw_list_pos: int = None):
-        if ((item_name := item_name[0].capitalize() + item_name[1:]) in _NAME_LIST):
-            _raw_list_pos = _raw_list_pos if _raw_list_pos else _NAME_LIST.index(item_name)
-            self.__info = _RAW_LIST[_raw_list_pos]
-            if ('lowalch' not in self.__info.keys()):
-                self.__info['lowalch'] = 'Not alchemisable'
-                self.__info['highalch'] = 'Not alchemisable'
+    __slots__ = ('__info', '__change', '__recent_history', '__fetched_at', '__ge_history',
+                 '__current_price', '__current_average')
+
+    def __init__(self, item_name: str | int, _raw_list_pos: int = None):
+        item_index = _get_index()
+        if _raw_list_pos is None:
+            _raw_list_pos = item_index.position(item_name)
+        if _raw_list_pos is not None:
+            self.__info = item_index.record(_raw_list_pos)
             self.__change = None
-            self.__recent_history = {'5m': None, '1h': None, '6h': None, '24h': None}
+            self.__recent_history = {}  # API timestep -> downloaded history not yet stored
+            self.__fetched_at = {}  # API timestep -> time recent history was downloaded
+            self.__ge_history = None  # 180 day history of the GE item page
 
             # these might not even be necessary until relevant information is called
             # e.g. current price, item pic, recent history
@@ -117,11 +362,11 @@ class Item():
             # self.__init_item_stats()
 
         else:
-            raise ValueError('Item not found: ' + item_name)
+            raise ValueError('Item not found: ' + str(item_name))
 
     def __init_item_basic(self):
         # Store item basic data if it does not already exist
-        db_man = DbManager()
+        db_man = _get_db()
 
         if db_man.is_item_stored(self.__item_data[1]):
             _, self.__item_pic = db_man.retrieve_item(self.__item_data[1])
@@ -129,79 +374,148 @@ class Item():
             self.__item_pic = _get_item_pic(self.__item_data[5], 7)
             db_man.store_item(self.__item_data[1], self.__item_data[0], self.__item_pic)
 
-        db_man.close_db()
+    def __get_raw_history(self, timestep) -> tuple[list[dict] | None, float, bool]:
+        """
+        Return the recent history of a timestep without missing data, the
+        time it was downloaded and whether it may be saved. Downloads are
+        shared by every Item until the end of the current timestep bucket.
+        """
+        return _get_history_cache().get((self.__info['id'], timestep),
+                                        _bucket_end(_TIMESTEP_SECONDS[timestep]),
+                                        lambda: self.__download_history(timestep))
 
-    # offer two ways to get item data
-    # use api for default since it will be faster
-    # user can eventually set preffered option
-    # if api is down use osrs ge site as backup and vice versa
-    def __get_raw_history(self, timestep):
-        raw_history = requests.get(_HISTORY_API.replace(_TIMESTEP_PARAMETER, timestep) + str(self.__info['id']),
-                                   headers=_REQUEST_HEADER,
-                                   timeout=100).json()['data']
-        return raw_history if raw_history else None
+    def __download_history(self, timestep) -> tuple[list[dict] | None, float, bool]:
+        fetched_at = time.time()
+        # the wiki API is preferred, the GE site is used when it is down or slow
+        raw_history, source = _get_provider().fetch(self.__info['id'], timestep)
+        return ((Item.__drop_missing(raw_history) if raw_history else None), fetched_at,
+                _get_provider().stored(source))
+
+    @staticmethod
+    def __drop_missing(raw_history: list[dict]) -> list[dict]:
+        # drop any missing data
+        return [row for row in raw_history if row['highPriceVolume'] or row['lowPriceVolume']]
 
     def __get_recent_history(self, timestep) -> pandas.DataFrame:
         if (timestep not in _TIMESTEP_MAP.values()):
             raise ValueError('Timestep must one of: ' + str(list(_TIMESTEP_MAP.values())))
-        history = self.__get_raw_history(timestep)
-        if (history):
-            history = pandas.DataFrame(history)
-            # drop any missing data
-            history = history.drop(history[(history['highPriceVolume'] == 0)
-                                           & (history['lowPriceVolume'] == 0)].index)
-            # store timestamp copy of history for possiblilty of save to database
-            self.__recent_history[timestep] = pandas.DataFrame(history)
+        history, fetched_at, stored = self.__get_raw_history(timestep)
+        if (history is not None):
+            if stored:
+                # store raw copy of history for possiblilty of save to database
+                self.__recent_history[timestep] = history
+                self.__fetched_at[timestep] = fetched_at
+            # convert timestamp to UTC datetime
+            history = _history_frame(history)
         else:
             print('Missing API history data for: ' + self.__info['name'])
         return history
 
-    def save_history(self, timestep=None):
-        DbMan = DbManager()
-        if (not DbMan.item_table_exists(self.__info['id'])):
-            DbMan.create_item_table(self.__info['id'])
-        new_records = 0
-        if (timestep):
-            if (timestep not in _TIMESTEP_MAP):
-                raise ValueError('Timestep must one of: ' + str(list(_TIMESTEP_MAP.keys())))
-            if (self.__recent_history[_TIMESTEP_MAP[timestep]] is not None):
-                new_records = DbMan.store_item_history(self.__info['id'],
-                                                       self.__recent_history[_TIMESTEP_MAP[timestep]])
+    def _fetch_history(self, api_timesteps: list[str] = None) -> list[str]:
+        """
+        Download recent history for the given API timesteps (default all)
+        without printing. Returns the API timesteps that had no history data.
+        """
+        missing = []
+        for api_timestep in (api_timesteps if api_timesteps else _TIMESTEP_MAP.values()):
+            history, fetched_at, stored = self.__get_raw_history(api_timestep)
+            if (history is not None and stored):
+                self.__recent_history[api_timestep] = history
             else:
-                print('Missing API history data for: ' + self.__info['name'])
-        else:
-            for ts in self.__recent_history:
-                if (self.__recent_history[ts] is not None):
-                    new_records = new_records + DbMan.store_item_history(
-                        self.__info['id'], self.__recent_history[ts])
-        DbMan.close_db()
+                # history of a fallback source is not saved and the timestep stays stale
+                missing.append(api_timestep)
+                if history is not None:
+                    continue
+            self.__fetched_at[api_timestep] = fetched_at
+        return missing
+
+    def _store_history(self, db_man: DbManager, api_timesteps: list[str] = None) -> int:
+        """
+        Store downloaded recent history and advance the sync high-water marks.
+        The stored records are released, the Item keeps no copy of them.
+        Returns the number of new records.
+        """
+        new_records = 0
+        api_timesteps = list(api_timesteps if api_timesteps else self.__recent_history)
+        with db_man.transaction():
+            for api_timestep in api_timesteps:
+                history = self.__recent_history.get(api_timestep)
+                if (history is not None):
+                    new_records += db_man.store_item_history(self.__info['id'], history,
+                                                             _TIMESTEP_SECONDS[api_timestep])
+                if api_timestep in self.__fetched_at:
+                    db_man.update_sync_state(self.__info['id'], _TIMESTEP_SECONDS[api_timestep],
+                                             max((row['timestamp'] for row in history), default=0)
+                                             if history else 0,
+                                             self.__fetched_at[api_timestep])
+        for api_timestep in api_timesteps:
+            self.__recent_history.pop(api_timestep, None)
+            self.__fetched_at.pop(api_timestep, None)
+        return new_records
+
+    def _stale_timesteps(self, sync_state: dict, max_age: float | timedelta = None,
+                         now: float = None) -> list[str]:
+        """
+        Return the API timesteps that need a sync according to sync_state,
+        (item id, timestep) -> (last timestamp, synced at), see DbManager.get_sync_state.
+        """
+        now = time.time() if now is None else now
+        if isinstance(max_age, timedelta):
+            max_age = max_age.total_seconds()
+        stale = []
+        for api_timestep, width in _TIMESTEP_SECONDS.items():
+            if (state := sync_state.get((self.__info['id'], width))) is None:
+                stale.append(api_timestep)
+                continue
+            last_timestamp, synced_at = state
+            # the newest finished bucket is already stored, nothing new can exist yet
+            if last_timestamp >= (now // width - 1) * width:
+                continue
+            if now - synced_at >= (width if max_age is None else max_age):
+                stale.append(api_timestep)
+        return stale
+
+    def save_history(self, timestep=None) -> int:
+        if (timestep and timestep not in _TIMESTEP_MAP):
+            raise ValueError('Timestep must one of: ' + str(list(_TIMESTEP_MAP.keys())))
+        if (timestep and self.__recent_history.get(_TIMESTEP_MAP[timestep]) is None):
+            print('Missing API history data for: ' + self.__info['name'])
+        new_records = self._store_history(_get_db(),
+                                          [_TIMESTEP_MAP[timestep]] if timestep else None)
         print(str(new_records) + ' new records added for item: ' + self.__info['name'])
+        return new_records
+
+    def sync(self, max_age: float | timedelta = None) -> int:
+        """
+        Download and store only the timesteps that are stale, see Catalog.sync.
+        Returns the number of new records.
+        """
+        db_man = _get_db()
+        stale = self._stale_timesteps(db_man.get_sync_state([self.__info['id']]), max_age)
+        if not stale:
+            return 0
+        self._fetch_history(stale)
+        return self._store_history(db_man, stale)
 
     def delete_history(self):
-        DbMan = DbManager()
+        DbMan = _get_db()
         if not DbMan.item_table_exists(self.__info['id']):
             return
         DbMan.delete_item_table(self.__info['id'])
-        DbMan.close_db()
 
     def __init_stats_no_api(self):
 
-        item_page = requests.get(_ITEM_URL + str(self.__info['id']),
-                                 headers=_REQUEST_HEADER,
-                                 timeout=100)
-        item_parser = self._ItemPageParser()
-        item_parser.feed(item_page.text)
-
-        gp_change_stats = item_parser.gp_change_stats
-        pc_change_stats = item_parser.pc_change_stats[::2]
+        item_page = _get(_ITEM_URL + str(self.__info['id']))
+        gp_change_stats, pc_change_stats, raw_item_history = _parse_item_page(item_page.text)
+        pc_change_stats = pc_change_stats[::2]
         self.__change = pandas.DataFrame([gp_change_stats, pc_change_stats],
                                          index=['Change', 'Percentage'],
                                          columns=['24hr', '1 month', '3 month', '6 month'])
 
-        raw_item_history = item_parser.raw_item_history
-        self.__recent_history = Item.__process_raw_history(raw_item_history, [])
-        self.__current_price = (current := self.__recent_history[178])[1]
-        self.__current_average = current[2]
+        self.__ge_history = _ge_history_frame(*_parse_price_history(raw_item_history))
+        if not self.__ge_history.empty:
+            self.__current_price = int(self.__ge_history[_GE_PRICE].iloc[-1])
+            self.__current_average = int(self.__ge_history[_GE_AVERAGE].iloc[-1])
 
     @property
     def name(self) -> str:
@@ -221,15 +535,15 @@ class Item():
 
     @property
     def lowalch(self) -> int:
-        return self.__info['lowalch']
+        return self.__info.get('lowalch', 'Not alchemisable')
 
     @property
     def highalch(self) -> int:
-        return self.__info['highalch']
+        return self.__info.get('highalch', 'Not alchemisable')
 
     @property
     def limit(self) -> int:
-        return self.__info['limit']
+        return self.__info.get('limit')
 
     @property
     def value(self) -> int:
@@ -257,32 +571,64 @@ class Item():
 
     @property
     def history_1day(self):
-        # convert timestamp to readable datetime
-        history = self.__get_recent_history('5m')
-        if (history is not None):
-            history['timestamp'] = history['timestamp'].map(datetime.fromtimestamp)
-        return history
+        return self.__get_recent_history('5m')
 
     @property
     def history_2week(self):
-        history = self.__get_recent_history('1h')
-        if (history is not None):
-            history['timestamp'] = history['timestamp'].map(datetime.fromtimestamp)
-        return history
+        return self.__get_recent_history('1h')
 
     @property
     def history_3month(self):
-        history = self.__get_recent_history('6h')
-        if (history is not None):
-            history['timestamp'] = history['timestamp'].map(datetime.fromtimestamp)
-        return history
+        return self.__get_recent_history('6h')
 
     @property
     def history_1year(self):
-        history = self.__get_recent_history('24h')
-        if (history is not None):
-            history['timestamp'] = history['timestamp'].map(datetime.fromtimestamp)
-        return history
+        return self.__get_recent_history('24h')
+
+    def aggregate(self, window, timestep: str = None, start=None, end=None,
+                  rolling: int = None) -> pandas.DataFrame:
+        """
+        Aggregate the stored history into candles of window inside the database,
+        nothing is downloaded.
+
+        :param window: bucket width in seconds or as a timedelta or string like '1h' or '7D'
+        :param timestep: stored timestep to aggregate, defaults to the widest one
+                         the window is a multiple of with history between start and end
+        :param start: first timestamp, a UNIX time, datetime or date string (UTC if naive)
+        :param end: last timestamp, inclusive
+        :param rolling: also return the mean spread of the last rolling buckets
+        :return: open and close mid price, highest avgHighPrice, lowest avgLowPrice,
+                 volume weighted average price, volume and mean spread per bucket
+        """
+        return _aggregate([self.__info['id']], [self.__info['name']], window, timestep,
+                          start, end, rolling).droplevel(_ITEM)
+
+    def history(self, timestep: str = None, start=None, end=None,
+                columns: list[str] = None) -> pandas.DataFrame | None:
+        """
+        Return the stored history between start and end without downloading
+        anything, only the rows in range and the requested columns are read.
+        Use save_history or sync first to bring the stored history up to date.
+
+        :param timestep: '5m', '1h', '6h', '24h' or '1day', '2week', '3month', '1year',
+                         every timestep merged by default
+        :param start: first timestamp, a UNIX time, datetime or date string (UTC if naive)
+        :param end: last timestamp, inclusive
+        :param columns: columns to read, every history column by default
+        """
+        return _get_db().get_item_history(self.__info['id'], _timestep_seconds(timestep),
+                                          start=_unix_seconds(start), end=_unix_seconds(end),
+                                          columns=columns)
+
+    def iter_history(self, chunk_size: int = _HISTORY_CHUNK, timestep: str = None, start=None,
+                     end=None, columns: list[str] = None) -> Iterator[pandas.DataFrame]:
+        """
+        Yield the stored history like history in DataFrames of at most
+        chunk_size rows, without holding the whole range in memory.
+        """
+        return _get_db().iter_item_history(self.__info['id'], chunk_size,
+                                           _timestep_seconds(timestep), _unix_seconds(start),
+                                           _unix_seconds(end), columns)
 
     @property
     def full_history(self):
@@ -291,53 +637,12 @@ class Item():
         already exists it will read the existing data and add any new historical data.
         """
         self.save_history()
-        DbMan = DbManager()
-        history = DbMan.get_item_history(self.__info['id'])
-        DbMan.close_db()
-        if (history is not None):
-            history['timestamp'] = history['timestamp'].map(datetime.fromtimestamp)
-        return history
+        return _get_db().get_item_history(self.__info['id'])
 
     def __str__(self):
         return self.name
 
-    @staticmethod
-    def __process_raw_history(raw_data: str,
-                              output_array: list[str, str]):
-
-        if (price_loc := raw_data.find(_VAR_PRICE + _DATA_START)) == -1:
-            return output_array
-
-        item_date = raw_data[price_loc + _PRICE_LEN + _DATA_START_LEN:
-                             price_loc + (end_paren_loc := raw_data[price_loc:].
-                                          find(_DATA_END)) - 1]
-        price = raw_data[(loc := price_loc
-                          + end_paren_loc + _DATA_END_LEN):
-                         loc + (comma_loc := raw_data[loc:].find(','))]
-        average = raw_data[(loc := loc + comma_loc):loc
-                           + (bracket_loc := raw_data[loc:].find(']'))]
-        if raw_data[loc:].find(_VAR_TRADE + _DATA_START) == -1:
-            trade = "No Trade Volume Data Available"
-        else:
-            trade_loc = raw_data[(loc := loc + bracket_loc):].find(',')
-            trade = raw_data[(loc := loc + trade_loc):loc + raw_data[loc:].find(']')]
-            trade = trade.strip(_DATA_END)
-        output_array.append((date(*(list(map(int, item_date.split('/'))))),
-                             price,
-                             average.strip(_DATA_END),
-                             trade))
-        return Item.__process_raw_history(raw_data[loc:], output_array)
-
     # OSRS website backup below
-    @staticmethod
-    def __format_history(data_historical: list[ItemHistoryData]):
-        data = list(map(lambda date_data: date_data[1:], data_historical))
-        dates = list(map(lambda date_data: date_data[0], data_historical))
-        return pandas.DataFrame(data, index=dates,
-                                columns=['Price',
-                                         'Average',
-                                         'Volume']).rename_axis('Date')
-
     @staticmethod
     def __format_price(price: str):
         if price.find('k') + 1:
@@ -347,44 +652,3 @@ class Item():
         if price.find('b') + 1:
             return int(float(price.split('b')[0]) * 1000000000)
         return int(price.replace(',', ''))
-
-    class _ItemPageParser(HTMLParser):
-        def __init__(self) -> None:
-            super().__init__()
-            self.__data = ''
-            self.__in_stats_div = False
-            self.__in_stats_ul = False
-            self.__is_gp_change = False
-
-            self.gp_change_stats = []
-            self.pc_change_stats = []
-            self.raw_item_history = ''
-
-        def handle_starttag(self, tag: str,
-                            attrs: list[tuple[str, str | None]]) -> None:
-            if (tag == 'div' and ('class', 'stats') in attrs):
-                self.__in_stats_div = True
-
-            if (tag == 'ul' and self.__in_stats_div):
-                self.__in_stats_ul = True
-
-            if tag == 'span':
-                if ('class', 'stats__gp-change') in attrs:
-                    self.__is_gp_change = True
-                elif ('class', 'stats__pc-change') in attrs:
-                    self.__is_gp_change = False
-
-        def handle_endtag(self, tag: str) -> None:
-            if (tag == 'div' and self.__in_stats_div):
-                self.__in_stats_div = self.__in_stats_ul = False
-
-            if (tag == 'span' and self.__in_stats_ul):
-                if self.__is_gp_change:
-                    self.gp_change_stats.append(self.__data)
-                else:
-                    self.pc_change_stats.append(self.__data)
-
-        def handle_data(self, data: str) -> None:
-            if data.find(_VAR_PRICE) != -1:
-                self.raw_item_history = data
-            self.__data = data
@@ -0,0 +1,183 @@
+"""
+Implements lazy loading and persistent caching of the wiki item mapping.
+
+The mapping is read from the data directory on first use and revalidated
+against the wiki in a background thread once it is older than the TTL.
+
+Copyright (C) 2022 moxxos
+"""
+
+import json
+import os
+import threading
+import time
+
+import requests
+
+from gppc._constant import _MAP_API, _MAPPING_TTL, _MAPPING_RETRY, _MAPPING_TIMEOUT
+from gppc._db import _appdata_path
+from gppc._http import _get
+
+_MAPPING_FILE = 'mapping.json'
+_MAPPING_META_FILE = 'mapping_meta.json'
+_BACKUP_MAPPING = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup_mapping.json')
+
+_lock = threading.Lock()
+_state = {
+    'raw_list': None,  # list of mapping records
+    'name_list': None,  # item names in mapping order
+    'meta': {},  # etag, last_modified and fetched time of the cached mapping
+    'version': 0,  # bumped every time the in-memory mapping is replaced
+    'refreshing': False,
+    'attempted': 0.0  # time of the last background revalidation attempt
+}
+
+
+def _mapping_paths() -> tuple[str, str]:
+    appdata_path = _appdata_path()
+    return (os.path.join(appdata_path, _MAPPING_FILE),
+            os.path.join(appdata_path, _MAPPING_META_FILE))
+
+
+def _write_json(path: str, data) -> None:
+    """Atomically replace path so readers never see a partial file."""
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as tmp_file:
+        json.dump(data, tmp_file)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _set_mapping(raw_list: list[dict], meta: dict) -> None:
+    _state['raw_list'] = raw_list
+    _state['name_list'] = [item['name'] for item in raw_list]
+    _state['meta'] = meta
+    _state['version'] += 1
+
+
+def _is_stale(meta: dict) -> bool:
+    return time.time() - meta.get('fetched', 0) > _MAPPING_TTL
+
+
+def _fetch_mapping(meta: dict) -> tuple[list[dict] | None, dict]:
+    """
+    Conditionally request the mapping.
+    Returns (None, meta) if the cached copy is still current.
+    """
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    response = _get(_MAP_API, headers=headers,
+                    timeout=(_MAPPING_TIMEOUT, _MAPPING_TIMEOUT))
+    new_meta = {'etag': response.headers.get('ETag', meta.get('etag')),
+                'last_modified': response.headers.get('Last-Modified', meta.get('last_modified')),
+                'fetched': time.time()}
+    if response.status_code == 304:
+        return None, new_meta
+    response.raise_for_status()
+    return response.json(), new_meta
+
+
+def _store_mapping(raw_list: list[dict] | None, meta: dict) -> None:
+    mapping_path, meta_path = _mapping_paths()
+    if raw_list is not None:
+        _write_json(mapping_path, raw_list)
+    _write_json(meta_path, meta)
+
+
+def _revalidate() -> None:
+    """Background refresh of a stale mapping."""
+    try:
+        raw_list, meta = _fetch_mapping(_state['meta'])
+        _store_mapping(raw_list, meta)
+        with _lock:
+            if raw_list is not None:
+                _set_mapping(raw_list, meta)
+            else:
+                _state['meta'] = meta
+    except (requests.RequestException, OSError, ValueError):
+        # keep serving the cached mapping, try again on a later lookup
+        pass
+    finally:
+        _state['refreshing'] = False
+
+
+def _start_revalidate() -> None:
+    with _lock:
+        if _state['refreshing'] or time.time() - _state['attempted'] < _MAPPING_RETRY:
+            return
+        _state['refreshing'] = True
+        _state['attempted'] = time.time()
+    threading.Thread(target=_revalidate, name='gppc-mapping-refresh', daemon=True).start()
+
+
+def _load_mapping() -> None:
+    """Load the mapping from the cache, the network or the bundled backup."""
+    mapping_path, meta_path = _mapping_paths()
+    raw_list = _read_json(mapping_path)
+    meta = _read_json(meta_path) or {}
+    if raw_list is not None:
+        _set_mapping(raw_list, meta)
+        return
+    try:
+        raw_list, meta = _fetch_mapping({})
+        _store_mapping(raw_list, meta)
+    except (requests.RequestException, OSError, ValueError):
+        # no network and no cache, fall back to the mapping shipped with gppc and
+        # cache it as never fetched, later starts load it from disk and only
+        # revalidate it in the background instead of blocking on the network again
+        raw_list = _read_json(_BACKUP_MAPPING)
+        meta = {'fetched': 0}
+        try:
+            _store_mapping(raw_list, meta)
+        except OSError:
+            pass
+    _set_mapping(raw_list, meta)
+
+
+def _ensure_mapping() -> None:
+    if _state['raw_list'] is None:
+        with _lock:
+            if _state['raw_list'] is None:
+                _load_mapping()
+    if _is_stale(_state['meta']):
+        _start_revalidate()
+
+
+def _raw_list() -> list[dict]:
+    """Return the item mapping, loading it on first use."""
+    _ensure_mapping()
+    return _state['raw_list']
+
+
+def _name_list() -> list[str]:
+    """Return item names in the same order as the mapping."""
+    _ensure_mapping()
+    return _state['name_list']
+
+
+def _mapping_version() -> int:
+    """Return a counter that changes whenever the mapping is replaced."""
+    _ensure_mapping()
+    return _state['version']
+
+
+def _refresh_mapping() -> None:
+    """Synchronously revalidate the cached mapping against the wiki."""
+    _ensure_mapping()
+    raw_list, meta = _fetch_mapping(_state['meta'])
+    _store_mapping(raw_list, meta)
+    with _lock:
+        if raw_list is not None:
+            _set_mapping(raw_list, meta)
+        else:
+            _state['meta'] = meta
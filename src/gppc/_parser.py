@@ -0,0 +1,399 @@
+"""
+Implements the HTML parser backends for GE search and item pages.
+
+Every backend turns a page into plain data:
+    search page -> ([(item_name, item_id, item_price, item_change, item_url, item_pic)],
+                    highest linked page number)
+    item page -> (gp_change_stats, pc_change_stats, raw_item_history)
+
+_parse_price_history turns the raw_item_history script of an item page into
+columns of the 180 day price and trade volume history in a single pass.
+
+The default regex backend only scans the parts of a page that hold data,
+an lxml backend is available when lxml is installed and the html.parser
+backend remains as a fallback for pages the faster backends fail on.
+benchmarks/bench_parser.py measures and cross-checks the backends.
+The backend can be chosen with set_parser_backend or the GPPC_PARSER
+environment variable.
+
+Copyright (C) 2022 moxxos
+"""
+
+import os
+import re
+from html import unescape
+from html.parser import HTMLParser
+
+from gppc._constant import _ITEM_PATH
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
+
+_ITEM_PATH_LEN = len(_ITEM_PATH)
+_VAR_PRICE = 'average180'
+
+SearchData = list[tuple[str, str, str, str, str, str]]
+ItemPageData = tuple[list[str], list[str], str]
+PriceHistoryData = tuple[list[str], list[int], list[int], list[int | None]]
+
+# average180.push([new Date('2023/09/21'), 236, 240]);
+# trade180.push([new Date('2023/09/21'), 8746294]);
+_HISTORY_POINT = re.compile(r"(average|trade)180\.push\(\[new Date\('(\d+)/(\d+)/(\d+)'\),"
+                            r"\s*(\d+)(?:,\s*(\d+))?\]\)")
+
+
+class _SearchPageParser(HTMLParser):
+    """
+    Returns an HTML parser that digests a search page and stores an array of
+    6-tuples depending on number of items found:
+    item_data = [(item_name, item_id, item_price,
+                 item_change, item_url, item_pic)]
+    """
+
+    def __init__(self, item: str = '', page='1') -> None:
+        super().__init__()
+        self.__item_data = []
+        self.__data = ''
+        self.__item_name = ''
+        self.__item_id = ''
+        self.__item_price = ''
+        self.__item_pic = ''
+        self.__item_link = ''
+        self.__in_results_table = False
+        self.__item_row = False
+        self.__in_page_list = False
+        self.__td_counter = 0
+        self.__page_count = int(page) if page else 1
+
+    def handle_starttag(self, tag: str,
+                        attrs: list[tuple[str, str | None]]) -> None:
+        """
+        attrs example: [('class', 'table-item-link'), ('href', 'https://...')]
+
+        A single item row should look like the following:
+        <tr>
+            <td><a href=item_link/ title=item_name><img/></td>
+            <td class='memberItem'></td> or <td class=''></td> for non-member
+            <td>item_price</td>
+            <td>item_change</td>
+        </tr>
+        """
+        if tag == 'a':
+            if (self.__item_row and not self.__item_id
+                    and 'href' in (attr_map := dict(attrs)) and 'title' in attr_map):
+                self.__item_name = attr_map['title']
+                self.__item_link = attr_map['href']
+                item_path_pos = self.__item_link.find(_ITEM_PATH)
+                self.__item_id = self.__item_link[(
+                    item_path_pos + _ITEM_PATH_LEN + 1):]
+
+        if (tag == 'table' and ('class', 'results-table') in attrs):
+            self.__in_results_table = True
+
+        if (self.__in_results_table and tag == 'tr'):
+            self.__item_row = True
+            self.__td_counter = 0
+            self.__item_id = ''
+
+        if (tag == 'div'
+                and ('class', 'paging') in attrs):
+            self.__in_page_list = True
+
+    def handle_endtag(self, tag: str) -> None:
+
+        if tag == 'td':
+            if self.__td_counter == 1:
+                # TODO extract and display members data
+                None
+            elif self.__td_counter == 2:
+                self.__item_price = self.__data
+            elif self.__td_counter == 3:
+                # self.__data is item_change on last td tag
+                self.__item_data.append((self.__item_name, self.__item_id,
+                                        self.__item_price, self.__data,
+                                        self.__item_link, self.__item_pic))
+            self.__td_counter += 1
+
+        if (tag == 'table' and self.__in_results_table):
+            self.__in_results_table = False
+
+        if (tag == 'a' and self.__in_page_list):
+            # remember the highest page linked, the pages are fetched by the caller
+            try:
+                self.__page_count = max(self.__page_count, int(self.__data))
+            except ValueError:
+                return
+        if (self.__in_page_list and tag == 'div'):
+            self.__in_page_list = False
+
+    def handle_startendtag(self, tag: str,
+                           attrs: list[tuple[str, str | None]]) -> None:
+        if (tag == 'img' and 'src' in (attr_map := dict(attrs))
+                and attr_map.get('title') == self.__item_name):
+            self.__item_pic = attr_map['src']
+
+    def handle_data(self, data: str) -> None:
+        # whitespace between tags is not data
+        if (data := data.strip()):
+            self.__data = data
+
+    def get_search_data(self) -> SearchData:
+        """Return search data."""
+        return self.__item_data
+
+    def get_page_count(self) -> int:
+        """Return the highest page number linked from this page."""
+        return self.__page_count
+
+
+class _ItemPageParser(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__()
+        self.__data = ''
+        self.__in_stats_div = False
+        self.__in_stats_ul = False
+        self.__is_gp_change = False
+
+        self.gp_change_stats = []
+        self.pc_change_stats = []
+        self.raw_item_history = ''
+
+    def handle_starttag(self, tag: str,
+                        attrs: list[tuple[str, str | None]]) -> None:
+        if (tag == 'div' and ('class', 'stats') in attrs):
+            self.__in_stats_div = True
+
+        if (tag == 'ul' and self.__in_stats_div):
+            self.__in_stats_ul = True
+
+        if tag == 'span':
+            if ('class', 'stats__gp-change') in attrs:
+                self.__is_gp_change = True
+            elif ('class', 'stats__pc-change') in attrs:
+                self.__is_gp_change = False
+
+    def handle_endtag(self, tag: str) -> None:
+        if (tag == 'div' and self.__in_stats_div):
+            self.__in_stats_div = self.__in_stats_ul = False
+
+        if (tag == 'span' and self.__in_stats_ul):
+            if self.__is_gp_change:
+                self.gp_change_stats.append(self.__data)
+            else:
+                self.pc_change_stats.append(self.__data)
+
+    def handle_data(self, data: str) -> None:
+        if _VAR_PRICE in data:
+            self.raw_item_history = data
+        self.__data = data
+
+
+def _html_search_page(page: str) -> tuple[SearchData, int]:
+    search_parser = _SearchPageParser()
+    search_parser.feed(page)
+    return search_parser.get_search_data(), search_parser.get_page_count()
+
+
+def _html_item_page(page: str) -> ItemPageData:
+    item_parser = _ItemPageParser()
+    item_parser.feed(page)
+    return item_parser.gp_change_stats, item_parser.pc_change_stats, item_parser.raw_item_history
+
+
+def _parse_price_history(raw_item_history: str) -> PriceHistoryData:
+    """
+    Parse the average180 and trade180 points of an item page script in one pass.
+    Returns the columns (dates, prices, averages, volumes), dates are ISO
+    formatted and volumes are None on days without trade180 data.
+    """
+    dates, prices, averages = [], [], []
+    trades = {}  # ISO date -> trade volume
+    for point in _HISTORY_POINT.finditer(raw_item_history):
+        item_date = f'{point[2]}-{int(point[3]):02d}-{int(point[4]):02d}'
+        if point[1] == 'trade':
+            trades[item_date] = int(point[5])
+        elif point[6] is not None:
+            dates.append(item_date)
+            prices.append(int(point[5]))
+            averages.append(int(point[6]))
+    volumes = [trades.get(item_date) for item_date in dates]
+    return dates, prices, averages, volumes
+
+
+# regex backend, each pattern only runs over the slice of the page it needs
+_RESULTS_TABLE = re.compile(r'<table\b[^>]*\bclass=["\']results-table["\'][^>]*>(.*?)</table>',
+                            re.S | re.I)
+_PAGING_DIV = re.compile(r'<div\b[^>]*\bclass=["\']paging["\'][^>]*>(.*?)</div>', re.S | re.I)
+_STATS_DIV = re.compile(r'<div\b[^>]*\bclass=["\']stats["\'][^>]*>(.*?)</div>', re.S | re.I)
+_ROW = re.compile(r'<tr\b[^>]*>(.*?)</tr>', re.S | re.I)
+_CELL = re.compile(r'<td\b[^>]*>(.*?)</td>', re.S | re.I)
+_TAG = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)([^>]*)>')
+_ATTR = re.compile(r'([^\s=/>]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))')
+_LINK = re.compile(r'<a\b[^>]*>(.*?)</a>', re.S | re.I)
+_SCRIPT = re.compile(r'<script\b[^>]*>(.*?)</script>', re.S | re.I)
+
+
+def _attrs(tag_body: str) -> dict[str, str]:
+    return {match[1].lower(): unescape(match[2] or match[3] or match[4])
+            for match in _ATTR.finditer(tag_body)}
+
+
+def _last_text(fragment: str) -> str:
+    """Return the last non blank text node of an HTML fragment."""
+    for text in reversed(_TAG.split(fragment)[::4]):
+        if (text := text.strip()):
+            return unescape(text)
+    return ''
+
+
+def _max_page(paging: str, page_count: int = 1) -> int:
+    for link in _LINK.finditer(paging):
+        try:
+            page_count = max(page_count, int(_last_text(link[1])))
+        except ValueError:
+            continue
+    return page_count
+
+
+def _regex_search_page(page: str) -> tuple[SearchData, int]:
+    item_data = []
+    if (table := _RESULTS_TABLE.search(page)):
+        for row in _ROW.finditer(table[1]):
+            cells = _CELL.findall(row[1])
+            if len(cells) < 4:
+                continue
+            item_name = item_link = item_pic = ''
+            for tag in _TAG.finditer(row[1]):
+                if tag[1] or tag[2].lower() not in ('a', 'img'):
+                    continue
+                attr_map = _attrs(tag[3])
+                if not item_link and tag[2].lower() == 'a' and 'href' in attr_map \
+                        and 'title' in attr_map:
+                    item_name, item_link = attr_map['title'], attr_map['href']
+                elif tag[2].lower() == 'img' and 'src' in attr_map \
+                        and attr_map.get('title') == item_name:
+                    item_pic = attr_map['src']
+                    break
+            item_id = item_link[item_link.find(_ITEM_PATH) + _ITEM_PATH_LEN + 1:]
+            item_data.append((item_name, item_id, _last_text(cells[2]), _last_text(cells[3]),
+                              item_link, item_pic))
+    paging = _PAGING_DIV.search(page)
+    return item_data, _max_page(paging[1]) if paging else 1
+
+
+def _regex_item_page(page: str) -> ItemPageData:
+    gp_change_stats = []
+    pc_change_stats = []
+    if (stats := _STATS_DIV.search(page)):
+        in_stats_ul = is_gp_change = False
+        data = ''
+        for text, closing, tag, tag_body in _stats_tokens(stats[1]):
+            if tag is None:
+                data = text
+            elif not closing and tag == 'ul':
+                in_stats_ul = True
+            elif not closing and tag == 'span':
+                span_class = _attrs(tag_body).get('class')
+                if span_class == 'stats__gp-change':
+                    is_gp_change = True
+                elif span_class == 'stats__pc-change':
+                    is_gp_change = False
+            elif closing and tag == 'span' and in_stats_ul:
+                (gp_change_stats if is_gp_change else pc_change_stats).append(data)
+    raw_item_history = ''
+    for script in _SCRIPT.finditer(page):
+        if _VAR_PRICE in script[1]:
+            raw_item_history = script[1]
+    return gp_change_stats, pc_change_stats, raw_item_history
+
+
+def _stats_tokens(fragment: str):
+    """Yield (text, closing, tag, tag_body) tokens, tag is None for text nodes."""
+    pos = 0
+    for tag in _TAG.finditer(fragment):
+        if tag.start() > pos:
+            yield unescape(fragment[pos:tag.start()]), None, None, None
+        yield None, bool(tag[1]), tag[2].lower(), tag[3]
+        pos = tag.end()
+    if pos < len(fragment):
+        yield unescape(fragment[pos:]), None, None, None
+
+
+def _lxml_search_page(page: str) -> tuple[SearchData, int]:
+    document = lxml_html.fromstring(page)
+    item_data = []
+    for row in document.xpath('//table[@class="results-table"]//tr'):
+        cells = row.xpath('./td')
+        if len(cells) < 4 or not (links := row.xpath('.//a[@href and @title]')):
+            continue
+        item_name, item_link = links[0].get('title'), links[0].get('href')
+        item_pic = row.xpath('.//img[@title=$title]/@src', title=item_name)
+        item_data.append((item_name,
+                          item_link[item_link.find(_ITEM_PATH) + _ITEM_PATH_LEN + 1:],
+                          _lxml_last_text(cells[2]), _lxml_last_text(cells[3]),
+                          item_link, item_pic[0] if item_pic else ''))
+    page_count = 1
+    for link_text in document.xpath('//div[@class="paging"]//a//text()'):
+        try:
+            page_count = max(page_count, int(link_text))
+        except ValueError:
+            continue
+    return item_data, page_count
+
+
+def _lxml_last_text(element) -> str:
+    for text in reversed(list(element.itertext())):
+        if (text := text.strip()):
+            return text
+    return ''
+
+
+_BACKENDS = {
+    'html': (_html_search_page, _html_item_page),
+    'regex': (_regex_search_page, _regex_item_page),
+    # the stats markup is tiny, item pages gain nothing from lxml
+    'lxml': (_lxml_search_page, _regex_item_page)
+}
+_backend = {'name': None}
+
+
+def set_parser_backend(name: str = None) -> None:
+    """
+    Choose how GE pages are parsed: 'regex' (default), 'lxml' (requires lxml)
+    or the slower 'html' fallback.
+    """
+    if name is not None and name not in _BACKENDS:
+        raise ValueError('parser backend must be one of: ' + str(list(_BACKENDS.keys())))
+    if name == 'lxml' and lxml_html is None:
+        raise ValueError('the lxml parser backend requires lxml to be installed')
+    _backend['name'] = name if name else 'regex'
+
+
+def _get_backend() -> str:
+    if _backend['name'] is None:
+        set_parser_backend(os.environ.get('GPPC_PARSER'))
+    return _backend['name']
+
+
+def _parse_search_page(page: str) -> tuple[SearchData, int]:
+    """
+    Parse a search page with the selected backend.
+    Returns the page's items and the highest page number it links to.
+    """
+    try:
+        return _BACKENDS[_get_backend()][0](page)
+    except (ValueError, IndexError, AttributeError):
+        return _html_search_page(page)
+
+
+def _parse_item_page(page: str) -> ItemPageData:
+    """
+    Parse an item page with the selected backend.
+    Returns (gp_change_stats, pc_change_stats, raw_item_history).
+    """
+    try:
+        return _BACKENDS[_get_backend()][1](page)
+    except (ValueError, IndexError, AttributeError):
+        return _html_item_page(page)
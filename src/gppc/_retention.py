@@ -0,0 +1,51 @@
+"""
+Implements the retention policy and compaction of stored history.
+
+Copyright (C) 2022 moxxos
+"""
+
+import time
+from datetime import timedelta
+
+from gppc._constant import _RETENTION, _TIMESTEP_SECONDS
+from gppc._db import _get_db
+
+_policy = dict(_RETENTION)  # API timestep -> retention in seconds, None keeps forever
+
+
+def configure_retention(policy: dict[str, float | timedelta | None]) -> None:
+    """
+    Set how long each timestep is kept before compact_history rolls it up
+    into the next coarser timestep of the policy, e.g.
+    configure_retention({'5m': timedelta(days=2), '1h': timedelta(days=30), '24h': None}).
+    Timesteps left out of the policy are never compacted.
+
+    :param policy: API timestep -> retention in seconds or as a timedelta, None keeps forever
+    """
+    new_policy = {}
+    for timestep, retention in policy.items():
+        if timestep not in _TIMESTEP_SECONDS:
+            raise ValueError('Timestep must be one of: ' + str(list(_TIMESTEP_SECONDS)))
+        if isinstance(retention, timedelta):
+            retention = retention.total_seconds()
+        if retention is not None and retention < 0:
+            raise ValueError('Retention must not be negative')
+        new_policy[timestep] = retention
+    _policy.clear()
+    _policy.update(new_policy)
+
+
+def compact_history(vacuum: bool = False) -> dict[str, int]:
+    """
+    Roll stored history older than its retention up into the next coarser
+    timestep with volume weighted average prices and summed volumes, then
+    return the freed space to the file system. Only history that aged past
+    its retention since the last run is read.
+
+    :param vacuum: rebuild the whole database, needed once to free space in
+                   databases created by older versions of gppc
+    :return: number of rolled up and deleted rows
+    """
+    policy = sorted(((_TIMESTEP_SECONDS[timestep], retention)
+                     for timestep, retention in _policy.items()))
+    return _get_db().compact_history(policy, time.time(), vacuum)
@@ -0,0 +1,186 @@
+"""
+Implements offline item search over the item mapping.
+
+Names are indexed by word and by trigram so that substring, word and fuzzy
+matches are found without scanning the mapping. Hits are priced from the
+wiki /latest prices, requested at most once per _LATEST_TTL for every item.
+
+Copyright (C) 2022 moxxos
+"""
+
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Iterator
+
+import requests
+
+from gppc._constant import _MAIN_URL, _SNAPSHOT_API, _LATEST_TTL
+from gppc._db import _get_db
+from gppc._http import _get
+from gppc._index import _fold
+from gppc._mapping import _raw_list, _mapping_version
+
+# match tiers, lower is better
+_EXACT = 0
+_PREFIX = 1
+_WORDS = 2
+_SUBSTRING = 3
+_FUZZY = 4
+
+_FUZZY_THRESHOLD = 0.3  # minimum trigram similarity of fuzzy matches
+
+
+def _trigrams(text: str) -> set[str]:
+    """Return the trigrams of a folded name, padded so short words have some."""
+    text = '  ' + text + ' '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _SearchIndex():
+    """
+    Ranks mapping records by how well their name matches a query.
+    Exact names come first, then names starting with the query, names
+    containing every query word, names containing the query and lastly
+    names with enough trigrams in common with the query.
+    """
+
+    def __init__(self, raw_list: list[dict]) -> None:
+        self.__raw_list = raw_list
+        self.__folded = [_fold(item['name']) for item in raw_list]
+        self.__trigram_count = []  # position in raw list -> number of name trigrams
+        self.__by_trigram = {}  # trigram -> positions in raw list
+        by_word = {}  # word -> positions in raw list
+        for pos, folded in enumerate(self.__folded):
+            trigrams = _trigrams(folded)
+            self.__trigram_count.append(len(trigrams))
+            for trigram in trigrams:
+                self.__by_trigram.setdefault(trigram, []).append(pos)
+            for word in set(folded.split()):
+                by_word.setdefault(word, []).append(pos)
+        self.__words = sorted(by_word)
+        self.__by_word = [by_word[word] for word in self.__words]
+
+    def __word_prefix(self, prefix: str) -> set[int]:
+        """Return the positions of names with a word starting with prefix."""
+        positions = set()
+        for i in range(bisect_left(self.__words, prefix), len(self.__words)):
+            if not self.__words[i].startswith(prefix):
+                break
+            positions.update(self.__by_word[i])
+        return positions
+
+    def __containing(self, query: str) -> list[int]:
+        """Return the positions of names containing query."""
+        if len(query) < 3:
+            return [pos for pos, folded in enumerate(self.__folded) if query in folded]
+        postings = sorted((self.__by_trigram.get(query[i:i + 3], [])
+                           for i in range(len(query) - 2)), key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        return [pos for pos in candidates if query in self.__folded[pos]]
+
+    def __similar(self, query: str) -> dict[int, float]:
+        """Return position -> trigram similarity of names similar to query."""
+        trigrams = _trigrams(query)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.__by_trigram.get(trigram, ()))
+        similar = {}
+        for pos, count in shared.items():
+            similarity = count / (len(trigrams) + self.__trigram_count[pos] - count)
+            if similarity >= _FUZZY_THRESHOLD:
+                similar[pos] = similarity
+        return similar
+
+    def search(self, query: str, limit: int = None, fuzzy: bool = True) -> list[dict]:
+        """
+        Return the mapping records matching query, best matches first.
+        Fuzzy matches are only returned when nothing else matches.
+
+        :param query: item name or part of it, case insensitive
+        :param limit: maximum number of records returned
+        :param fuzzy: allow misspelled matches
+        """
+        query = _fold(query)
+        if not query:
+            return []
+        ranks = {}  # position in raw list -> (tier, tie breaker)
+        for pos in self.__containing(query):
+            folded = self.__folded[pos]
+            if folded == query:
+                ranks[pos] = (_EXACT, 0)
+            else:
+                ranks[pos] = (_PREFIX if folded.startswith(query) else _SUBSTRING, 0)
+        words = query.split()
+        if len(words) > 1:
+            matches = self.__word_prefix(words[0])
+            for word in words[1:]:
+                matches &= self.__word_prefix(word)
+            for pos in matches:
+                ranks[pos] = min(ranks.get(pos, (_WORDS, 0)), (_WORDS, 0))
+        if not ranks and fuzzy:
+            ranks = {pos: (_FUZZY, -similarity)
+                     for pos, similarity in self.__similar(query).items()}
+        order = sorted(ranks, key=lambda pos: (*ranks[pos], len(self.__folded[pos]),
+                                               self.__folded[pos]))
+        return [self.__raw_list[pos] for pos in order[:limit]]
+
+
+_search_cache = {'version': None, 'index': None}
+
+
+def _get_search_index() -> _SearchIndex:
+    """Return the search index, rebuilding it whenever the mapping changes."""
+    version = _mapping_version()
+    if _search_cache['version'] != version:
+        _search_cache['index'] = _SearchIndex(_raw_list())
+        _search_cache['version'] = version
+    return _search_cache['index']
+
+
+_latest_state = {'fetched': 0.0}  # time of the last /latest request
+
+
+def _latest_prices(item_ids: list[int]) -> dict[int, tuple]:
+    """
+    Return item id -> (high, highTime, low, lowTime) of the latest prices.
+    The whole market /latest response is requested at most once per _LATEST_TTL,
+    without network the prices stored by earlier requests are used.
+    """
+    db_man = _get_db()
+    if time.time() - _latest_state['fetched'] > _LATEST_TTL:
+        try:
+            response = _get(_SNAPSHOT_API['latest'])
+            response.raise_for_status()
+            db_man.store_latest(response.json())
+            _latest_state['fetched'] = time.time()
+        except (requests.RequestException, ValueError):
+            pass
+    return db_man.get_latest(item_ids)
+
+
+def _format_price(price: int | None) -> str:
+    return '-' if price is None else f'{price:,}'
+
+
+def _iter_local_search(item: str, max_results: int = None
+                       ) -> Iterator[tuple[str, str, str, str, str, str]]:
+    """
+    Search the item mapping, yielding found items in the same 6-tuples as the
+    Grand Exchange search, with the instant buy and sell prices in place of the
+    price and change:
+    (item_name, item_id, buy_price, sell_price, item_url, item_pic_link)
+
+    :param item: item name or part of it
+    :param max_results: stop once this many items were found
+    """
+    records = _get_search_index().search(item, max_results)
+    if not records:
+        return
+    prices = _latest_prices([record['id'] for record in records])
+    for record in records:
+        high, _, low, _ = prices.get(record['id'], (None, None, None, None))
+        yield (record['name'], str(record['id']), _format_price(high), _format_price(low),
+               _MAIN_URL + '/' + record['name'].replace(' ', '+')
+               + '/viewitem?obj=' + str(record['id']),
+               _MAIN_URL + '/obj_sprite.gif?id=' + str(record['id']))
@@ -0,0 +1,287 @@
+"""
+Implements the item history data sources and failover between them.
+
+History comes from the wiki timeseries API or, for daily history, from the
+GE item page. Every source keeps a rolling window of its latency and errors.
+Requests go to the healthiest source first and fail over to the next one,
+and a second request is hedged to the next source once the first one is
+slower than a latency percentile of its recent responses. Hedges run on a
+small pool of their own and are skipped while it is busy. Latencies are
+measured from when the rate limit lets a request go, so waiting behind other
+requests of gppc is never mistaken for a slow source.
+
+Copyright (C) 2022 moxxos
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+
+from gppc._constant import (_ITEM_URL,
+                            _HISTORY_API,
+                            _TIMESTEP_PARAMETER,
+                            _SOURCE_WINDOW,
+                            _SOURCE_MAX_ERROR_RATE,
+                            _HEDGE_PERCENTILE,
+                            _HEDGE_DELAY,
+                            _HEDGE_MIN_SAMPLES,
+                            _HEDGE_WORKERS)
+from gppc._http import _get, _throttle
+from gppc._parser import _parse_item_page, _parse_price_history
+
+# errors that make a source fail over, anything else is a bug
+_SOURCE_ERRORS = (requests.RequestException, ValueError, KeyError, IndexError)
+
+
+class _SourceStats():
+    """Rolling latency and error rate of the last window requests to a source."""
+
+    def __init__(self, window: int) -> None:
+        self.__samples = deque(maxlen=window)  # (seconds, succeeded)
+        self.__lock = threading.Lock()
+
+    def record(self, seconds: float, succeeded: bool) -> None:
+        with self.__lock:
+            self.__samples.append((seconds, succeeded))
+
+    def error_rate(self) -> float:
+        with self.__lock:
+            samples = list(self.__samples)
+        return sum(not ok for _, ok in samples) / len(samples) if samples else 0.0
+
+    def latency(self, percentile: float) -> float | None:
+        """Return the latency percentile of successful requests, None without enough data."""
+        with self.__lock:
+            latencies = sorted(seconds for seconds, ok in self.__samples if ok)
+        if len(latencies) < _HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def summary(self) -> dict:
+        with self.__lock:
+            requests_made = len(self.__samples)
+        return {'requests': requests_made,
+                'error_rate': self.error_rate(),
+                'p50': self.latency(50),
+                'p95': self.latency(95),
+                'p99': self.latency(99)}
+
+
+class _WikiSource():
+    """The wiki timeseries API, every timestep."""
+    name = 'wiki'
+    stored = True  # history may be saved to the database
+
+    def supports(self, timestep: str) -> bool:
+        return True
+
+    def throttle(self) -> None:
+        """Wait until the rate limit lets the next request go."""
+        _throttle(_HISTORY_API)
+
+    def fetch(self, item_id: int, timestep: str) -> list[dict]:
+        """Request the history of an item timestep, throttle must be called first."""
+        response = _get(_HISTORY_API.replace(_TIMESTEP_PARAMETER, timestep) + str(item_id),
+                        throttled=True)
+        response.raise_for_status()
+        return response.json()['data']
+
+
+class _GeSource():
+    """
+    The 180 day history of the GE item page, daily timestep only.
+    The GE guide price is used for both average prices and the day's trade
+    volume is split evenly between the high and low price volumes, so its
+    history is only shown and never saved in place of real wiki history.
+    """
+    name = 'ge'
+    stored = False
+
+    def supports(self, timestep: str) -> bool:
+        return timestep == '24h'
+
+    def throttle(self) -> None:
+        _throttle(_ITEM_URL)
+
+    def fetch(self, item_id: int, timestep: str) -> list[dict]:
+        response = _get(_ITEM_URL + str(item_id), throttled=True)
+        response.raise_for_status()
+        dates, prices, _, volumes = _parse_price_history(_parse_item_page(response.text)[2])
+        history = []
+        for item_date, price, volume in zip(dates, prices, volumes):
+            volume = volume or 0
+            history.append({'timestamp': int(datetime.fromisoformat(item_date)
+                                             .replace(tzinfo=timezone.utc).timestamp()),
+                            'avgHighPrice': price,
+                            'avgLowPrice': price,
+                            'highPriceVolume': volume - volume // 2,
+                            'lowPriceVolume': volume // 2})
+        return history
+
+
+class _HistoryProvider():
+    """Fetches item history from the healthiest source with failover and hedging."""
+
+    def __init__(self, sources: list) -> None:
+        self.__sources = {source.name: source for source in sources}
+        self.__stats = {source.name: _SourceStats(_SOURCE_WINDOW) for source in sources}
+        self.__order = [source.name for source in sources]
+        self.__hedge = True
+        self.__hedge_percentile = _HEDGE_PERCENTILE
+        self.__max_error_rate = _SOURCE_MAX_ERROR_RATE
+        # hedges only, first requests run on the calling thread and never queue behind them
+        self.__hedge_executor = ThreadPoolExecutor(max_workers=_HEDGE_WORKERS,
+                                                   thread_name_prefix='gppc-hedge')
+        self.__hedge_slots = threading.BoundedSemaphore(_HEDGE_WORKERS)
+
+    def configure(self, order: list[str] = None, hedge: bool = None,
+                  hedge_percentile: float = None, max_error_rate: float = None) -> None:
+        if order is not None:
+            if not order or any(name not in self.__sources for name in order):
+                raise ValueError('Sources must be some of: ' + str(list(self.__sources)))
+            self.__order = list(order)
+        if hedge is not None:
+            self.__hedge = hedge
+        if hedge_percentile is not None:
+            if not 0 < hedge_percentile <= 100:
+                raise ValueError('Hedge percentile must be between 0 and 100')
+            self.__hedge_percentile = hedge_percentile
+        if max_error_rate is not None:
+            self.__max_error_rate = max_error_rate
+
+    def stats(self) -> dict[str, dict]:
+        return {name: self.__stats[name].summary() for name in self.__order}
+
+    def __candidates(self, timestep: str) -> list[str]:
+        """Sources able to serve timestep, unhealthy ones last, otherwise in configured order."""
+        names = [name for name in self.__order if self.__sources[name].supports(timestep)]
+        return sorted(names, key=lambda name: self.__stats[name].error_rate()
+                      > self.__max_error_rate)
+
+    def __timed_fetch(self, name: str, item_id: int, timestep: str,
+                      throttled: bool = False) -> list[dict]:
+        """Fetch from a source, timing only the request and not the rate limit wait."""
+        if not throttled:
+            self.__sources[name].throttle()
+        start = time.monotonic()
+        try:
+            history = self.__sources[name].fetch(item_id, timestep)
+        except _SOURCE_ERRORS:
+            self.__stats[name].record(time.monotonic() - start, False)
+            raise
+        self.__stats[name].record(time.monotonic() - start, True)
+        return history
+
+    def stored(self, name: str | None) -> bool:
+        """Return True if history from the named source may be saved to the database."""
+        return name is not None and self.__sources[name].stored
+
+    def fetch(self, item_id: int, timestep: str) -> tuple[list[dict] | None, str | None]:
+        """
+        Return the raw history of an item timestep and the name of the source
+        it came from, (None, None) if no source has any.
+        Raises the last error if every source failed.
+        """
+        candidates = self.__candidates(timestep)
+        if not self.__hedge or len(candidates) < 2:
+            return self.__fetch_in_order(candidates, item_id, timestep)
+        return self.__fetch_hedged(candidates, item_id, timestep)
+
+    def __fetch_in_order(self, candidates: list[str], item_id: int,
+                         timestep: str) -> tuple[list[dict] | None, str | None]:
+        error = None
+        for name in candidates:
+            try:
+                if (history := self.__timed_fetch(name, item_id, timestep)):
+                    return history, name
+            except _SOURCE_ERRORS as source_error:
+                error = source_error
+        if error is not None:
+            raise error
+        return None, None
+
+    def __fetch_hedged(self, candidates: list[str], item_id: int,
+                       timestep: str) -> tuple[list[dict] | None, str | None]:
+        """
+        Fetch from the first source on the calling thread. Once it is slower
+        than its latency percentile a hedge is started on the next source in
+        the hedge pool, unless every hedge worker is busy. The first source's
+        history is returned if it has any, otherwise the already running
+        hedge's, then the remaining sources are tried in order. A hedge never
+        delays the first source, it saves the failover time when that fails.
+        """
+        delay = self.__stats[candidates[0]].latency(self.__hedge_percentile)
+        hedge = {'done': False, 'future': None}
+        lock = threading.Lock()
+
+        def start_hedge() -> None:
+            with lock:
+                if hedge['done'] or not self.__hedge_slots.acquire(blocking=False):
+                    return
+                hedge['future'] = self.__hedge_executor.submit(self.__run_hedge, candidates[1],
+                                                               item_id, timestep)
+
+        # started once the rate limit lets the request go so the delay never includes queueing
+        self.__sources[candidates[0]].throttle()
+        timer = threading.Timer(_HEDGE_DELAY if delay is None else delay, start_hedge)
+        timer.daemon = True
+        timer.start()
+        error = None
+        try:
+            if (history := self.__timed_fetch(candidates[0], item_id, timestep, throttled=True)):
+                return history, candidates[0]
+        except _SOURCE_ERRORS as source_error:
+            error = source_error
+        finally:
+            timer.cancel()
+            with lock:
+                hedge['done'] = True
+        remaining = candidates[1:]
+        if hedge['future'] is not None:
+            remaining = candidates[2:]
+            try:
+                if (history := hedge['future'].result()):
+                    return history, candidates[1]
+            except _SOURCE_ERRORS as source_error:
+                error = source_error
+        if (found := self.__fetch_in_order(remaining, item_id, timestep))[0]:
+            return found
+        if error is not None:
+            raise error
+        return None, None
+
+    def __run_hedge(self, name: str, item_id: int, timestep: str) -> list[dict]:
+        try:
+            return self.__timed_fetch(name, item_id, timestep)
+        finally:
+            self.__hedge_slots.release()
+
+
+_provider = _HistoryProvider([_WikiSource(), _GeSource()])
+
+
+def _get_provider() -> _HistoryProvider:
+    return _provider
+
+
+def configure_history_sources(order: list[str] = None, hedge: bool = None,
+                              hedge_percentile: float = None,
+                              max_error_rate: float = None) -> None:
+    """
+    Configure where item history is fetched from.
+
+    :param order: preferred sources, 'wiki' (timeseries API) and 'ge' (GE item page, daily only)
+    :param hedge: request the next source when the first one is slow
+    :param hedge_percentile: latency percentile of a source after which a request is hedged
+    :param max_error_rate: error rate in the rolling window after which a source is tried last
+    """
+    _provider.configure(order, hedge, hedge_percentile, max_error_rate)
+
+
+def history_source_stats() -> dict[str, dict]:
+    """Return the rolling request count, error rate and latency percentiles of each source."""
+    return _provider.stats()
@@ -0,0 +1,98 @@
+"""
+Shared fixtures: an isolated gppc data directory and a local JSON fixture server.
+
+Copyright (C) 2022 moxxos
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from gppc import _db, _mapping
+from gppc._db import DbManager
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def store_rows(db, item_id: int, timestep: int, rows: list[tuple]) -> None:
+    """Store rows of (timestamp, avgHighPrice, avgLowPrice, highPriceVolume, lowPriceVolume)."""
+    db.store_item_history(item_id, [{'timestamp': row[0], 'avgHighPrice': row[1],
+                                     'avgLowPrice': row[2], 'highPriceVolume': row[3],
+                                     'lowPriceVolume': row[4]} for row in rows], timestep)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """A DbManager on an empty database."""
+    db_man = DbManager(str(tmp_path / 'gppc.sql'))
+    yield db_man
+    db_man.close_db()
+
+
+@pytest.fixture
+def gppc_home(tmp_path, monkeypatch):
+    """
+    Point the gppc data directory at tmp_path with the fixture item mapping
+    cached as freshly fetched, so nothing is requested from the wiki.
+    Returns the data directory.
+    """
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    data_dir = _db._appdata_path()
+    shutil.copy(os.path.join(FIXTURES, 'mapping.json'), os.path.join(data_dir, 'mapping.json'))
+    with open(os.path.join(data_dir, 'mapping_meta.json'), 'w', encoding='utf-8') as meta:
+        json.dump({'fetched': time.time()}, meta)
+    monkeypatch.setitem(_mapping._state, 'raw_list', None)
+    monkeypatch.setattr(_db._local, 'db_man', None, raising=False)
+    yield data_dir
+    if (db_man := getattr(_db._local, 'db_man', None)) is not None:
+        db_man.close_db()
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves tests/fixtures/<name>.json at /<name>, recording every request path.
+    Responses carry an ETag and a matching If-None-Match is answered with 304.
+    """
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        name = self.path.split('?')[0].strip('/')
+        try:
+            with open(os.path.join(FIXTURES, name + '.json'), 'rb') as fixture:
+                body = fixture.read()
+        except OSError:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fixture_server():
+    """A local HTTP server of the JSON fixtures, yields (base url, requested paths)."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+    server.paths = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', server.paths
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,43 @@
+"""
+Tests aggregation of stored history into candles.
+
+Copyright (C) 2022 moxxos
+"""
+
+import pytest
+
+from gppc import Item
+from gppc._db import _get_db
+
+from conftest import store_rows
+
+HOUR = 1699999200  # aligned to an hour but not to 6 hours
+
+
+def test_aggregate_history_candles(db):
+    store_rows(db, 453, 300, [(HOUR, 100, 90, 10, 5),
+                              (HOUR + 300, 110, None, 4, 0),
+                              (HOUR + 600, 105, 95, 1, 1),
+                              (HOUR + 3600, 120, 100, 2, 2)])
+    first, second = db.aggregate_history(3600, 300, [453], rolling=2)
+    assert first[:6] == (453, HOUR, 95, 110, 90, 100)
+    assert first[6] == pytest.approx(2090 / 21)
+    assert first[7:] == (21, 10, 10)
+    assert second == (453, HOUR + 3600, 110, 120, 100, 110, 110, 4, 20, 15)
+    assert db.aggregate_history(3600, 300, [453], start=HOUR + 3600) == [
+        (453, HOUR + 3600, 110, 120, 100, 110, 110, 4, 20)]
+    assert db.aggregate_history(3600, 300, [440]) == []
+
+
+def test_aggregate_history_rejects_bad_windows(db):
+    with pytest.raises(ValueError):
+        db.aggregate_history(1000, 300)
+    with pytest.raises(ValueError):
+        db.aggregate_history(3600, 300, rolling=0)
+
+
+def test_item_aggregate_uses_a_stored_timestep(gppc_home):
+    store_rows(_get_db(), 4151, 300, [(HOUR + i * 300, 1000 + i, 990, 1, 1) for i in range(24)])
+    candles = Item(4151).aggregate('1h')
+    assert candles['volume'].tolist() == [24, 24]
+    assert candles.equals(Item(4151).aggregate('1h', timestep='5m'))
@@ -0,0 +1,72 @@
+"""
+Tests the expiring LRU cache of recent history.
+
+Copyright (C) 2022 moxxos
+"""
+
+import threading
+import time
+
+import pytest
+
+from gppc._cache import _TtlCache, _bucket_end
+
+
+def _forever(loaded_at: float) -> float:
+    return loaded_at + 3600
+
+
+def test_hits_until_expired():
+    cache = _TtlCache(100, lambda value: 1)
+    assert cache.get('coal', _forever, lambda: 'a') == 'a'
+    assert cache.get('coal', _forever, lambda: 'b') == 'a'
+    assert cache.get('iron', lambda loaded_at: loaded_at - 1, lambda: 'c') == 'c'
+    assert cache.get('iron', _forever, lambda: 'd') == 'd'
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = _TtlCache(2, lambda value: 1)
+    cache.get('coal', _forever, lambda: 1)
+    cache.get('iron', _forever, lambda: 2)
+    cache.get('coal', _forever, lambda: None)
+    cache.get('whip', _forever, lambda: 3)
+    assert cache.get('iron', _forever, lambda: 'reloaded') == 'reloaded'
+    assert cache.get('whip', _forever, lambda: None) == 3
+    assert cache.stats()['bytes'] <= 2 and cache.stats()['evictions'] == 2
+
+
+def test_concurrent_misses_share_one_load():
+    cache = _TtlCache(100, lambda value: 1)
+    loads = []
+
+    def load():
+        loads.append(1)
+        time.sleep(0.1)
+        return 'history'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('coal', _forever, load)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['history'] * 8
+    assert len(loads) == 1 and cache.stats()['coalesced'] == 7
+
+
+def test_errors_are_not_cached():
+    cache = _TtlCache(100, lambda value: 1)
+
+    def fail():
+        raise ValueError('no history')
+
+    with pytest.raises(ValueError):
+        cache.get('coal', _forever, fail)
+    assert cache.get('coal', _forever, lambda: 'history') == 'history'
+
+
+def test_bucket_end():
+    assert _bucket_end(300)(1700000000) == 1700000100
+    assert _bucket_end(300)(1700000100) == 1700000400
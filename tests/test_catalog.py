@@ -0,0 +1,84 @@
+"""
+Tests the list methods, views and filters of Catalog over the columnar item mapping.
+
+Copyright (C) 2022 moxxos
+"""
+
+import pytest
+
+from gppc import Catalog
+from gppc._mapping import _raw_list, _set_mapping
+
+_NEW_ITEM = {'id': 30000, 'name': 'Zenyte shard', 'members': True, 'limit': 5,
+             'value': 10000, 'lowalch': 4000, 'highalch': 6000}
+
+
+def test_list_methods(gppc_home):
+    catalog = Catalog('Coal', 'iron ore')
+    catalog.append('Abyssal whip')
+    catalog.insert(0, 2)
+    catalog.extend(['Coal'])
+    assert catalog == ['Cannonball', 'Coal', 'Iron ore', 'Abyssal whip', 'Coal']
+    assert catalog.index('Coal') == 1 and catalog.index('Coal', 2) == 4
+    assert catalog.count(453) == 2 and catalog.count('Nothing') == 0
+    catalog.remove('Coal')
+    assert catalog.pop().name == 'Coal'
+    del catalog['Iron ore']
+    assert catalog.names == ['Cannonball', 'Abyssal whip']
+    catalog.sort()
+    assert catalog.names == ['Abyssal whip', 'Cannonball']
+    catalog.reverse()
+    assert catalog.ids == [2, 4151]
+    with pytest.raises(ValueError):
+        catalog.append('Nothing')
+    catalog.clear()
+    assert len(catalog) == 0
+
+
+def test_keys_resolve_against_the_catalog_mapping(gppc_home):
+    catalog = Catalog('Coal', 'Iron ore')
+    full = Catalog()
+    # the mapping is replaced, e.g. by a background revalidation, with positions shifted
+    _set_mapping([_NEW_ITEM, *_raw_list()], {'fetched': 0})
+    assert catalog['Coal'].name == 'Coal'
+    assert 'Abyssal whip' not in catalog
+    full.append('Coal')
+    assert full[-1].name == 'Coal'
+    assert full.index('Coal') == 2 and full.count('Zenyte shard') == 0
+    assert Catalog('Zenyte shard').ids == [30000]
+
+
+def test_slices_are_views_sharing_items(gppc_home):
+    catalog = Catalog()
+    view = catalog[1:3]
+    assert view == ['Cannonball', 'Coal']
+    assert view['Coal'] is catalog['Coal']
+    # changing a catalog replaces its positions and never the ones of its views
+    catalog.reverse()
+    assert view == ['Cannonball', 'Coal'] and catalog[0].name == 'Iron ore'
+    view.append('Iron ore')
+    assert len(catalog) == 4 and view[-1] is catalog[0]
+
+
+def test_where(gppc_home):
+    catalog = Catalog()
+    assert catalog.where(members=False) == ['Coal', 'Iron ore']
+    assert catalog.where(limit__gte=13000, value__lt=40).names == ['Iron ore']
+    assert catalog.where(id__range=(440, 453)).ids == [453, 440]
+    assert catalog.where(id__in=[440, 4151], highalch__ne=10) == ['Abyssal whip']
+    assert catalog[2:].where(members=True) == []
+    with pytest.raises(ValueError):
+        catalog.where(name='Coal')
+    with pytest.raises(ValueError):
+        catalog.where(limit__like=10)
+    with pytest.raises(ValueError):
+        catalog.where(limit__gt=None)
+
+
+def test_where_missing_attributes(gppc_home):
+    _set_mapping([*_raw_list(), {'id': 13190, 'name': 'Old school bond', 'members': False,
+                                 'value': 0}], {'fetched': 0})
+    catalog = Catalog()
+    assert catalog.where(lowalch=None) == ['Old school bond']
+    assert len(catalog.where(limit__ne=None)) == 4
+    assert 'Old school bond' not in catalog.where(highalch__lt=100)
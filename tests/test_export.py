@@ -0,0 +1,51 @@
+"""
+Tests columnar export of stored history and filtered reads.
+
+Copyright (C) 2022 moxxos
+"""
+
+import os
+
+import pytest
+
+from gppc import export_history, read_history
+from gppc._db import _get_db
+
+pytest.importorskip('pyarrow')
+
+DAY = 1699920000  # aligned to a day
+
+
+@pytest.fixture
+def stored(gppc_home):
+    db = _get_db()
+    for timestep, rows in ((300, [DAY, DAY + 300]), (86400, [DAY - 86400, DAY])):
+        db.store_item_history(453, [{'timestamp': timestamp, 'avgHighPrice': 150,
+                                     'avgLowPrice': 148, 'highPriceVolume': 10,
+                                     'lowPriceVolume': 20} for timestamp in rows], timestep)
+    return gppc_home
+
+
+@pytest.mark.parametrize('file_format', ['arrow', 'parquet'])
+def test_read_history_filters(stored, file_format):
+    path = export_history(file_format=file_format)
+    assert os.path.isfile(os.path.join(path, '.gppc_export'))
+    history = read_history(file_format=file_format, timestep='1day')
+    assert history['timestamp'].tolist() == read_history(file_format=file_format,
+                                                         timestep='5m')['timestamp'].tolist()
+    assert str(history['timestamp'].dtype) == 'datetime64[s, UTC]'
+    daily = read_history(file_format=file_format, timestep='24h', start=DAY)
+    assert len(daily) == 1 and daily['timestep'].tolist() == [86400]
+    assert read_history(file_format=file_format, arrow=True,
+                        item_ids=[440]).num_rows == 0
+    with pytest.raises(ValueError):
+        read_history(file_format=file_format, timestep=300)
+
+
+def test_export_refuses_other_directories(stored, tmp_path):
+    other = tmp_path / 'other'
+    other.mkdir()
+    (other / 'notes.txt').write_text('keep')
+    with pytest.raises(ValueError):
+        export_history(str(other))
+    assert export_history() == export_history()
@@ -0,0 +1,23 @@
+"""
+Tests reading stored item history.
+
+Copyright (C) 2022 moxxos
+"""
+
+from conftest import store_rows
+
+DAY = 1699920000  # aligned to a day
+
+
+def test_iter_item_history_finest_bucket_wins(db):
+    store_rows(db, 453, 86400, [(DAY, 1, 1, 1, 1), (DAY + 86400, 2, 2, 2, 2)])
+    store_rows(db, 453, 3600, [(DAY, 10, 10, 10, 10), (DAY + 3600, 11, 11, 11, 11)])
+    store_rows(db, 453, 300, [(DAY + 3600, 20, 20, 20, 20), (DAY + 3900, 21, 21, 21, 21)])
+    chunks = list(db.iter_item_history(453, 2, columns=['avgHighPrice']))
+    # one row per timestamp, taken from the finest timestep stored for it
+    assert [len(chunk) for chunk in chunks] == [2, 2]
+    assert [price for chunk in chunks for price in chunk['avgHighPrice'].tolist()] == [
+        10, 20, 21, 2]
+    assert db.get_item_history(453, start=DAY + 3600, end=DAY + 3900)[
+        'avgHighPrice'].tolist() == [20, 21]
+    assert db.get_item_history(453, 86400, start=DAY + 1)['avgHighPrice'].tolist() == [2]
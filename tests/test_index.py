@@ -0,0 +1,27 @@
+"""
+Tests item lookups in the item index and storing the info of looked up items.
+
+Copyright (C) 2022 moxxos
+"""
+
+import numpy
+
+from gppc._index import _get_index
+
+
+def test_lookups(gppc_home):
+    index = _get_index()
+    assert index.find('Coal')['id'] == 453
+    assert index.find('  iron   ORE ')['id'] == 440
+    assert index.find(numpy.int32(4151))['name'] == 'Abyssal whip'
+    assert index.find('Nothing') is None and index.find(1) is None
+    assert [record['name'] for record in index.prefix('c')] == ['Cannonball', 'Coal']
+    assert [record['name'] for record in index.prefix('c', limit=1)] == ['Cannonball']
+
+
+def test_store_item_info_without_alch_values(db):
+    bond = {'examine': 'A bond.', 'id': 13190, 'members': False, 'value': 0,
+            'icon': 'Old school bond.png', 'name': 'Old school bond'}
+    db.store_item_info(bond, '')
+    assert db.retrieve_item_info(13190)[:7] == (13190, 'Old school bond', 'A bond.', 0,
+                                                None, None, None)
@@ -0,0 +1,73 @@
+"""
+Tests loading, caching and revalidating the item mapping.
+
+Copyright (C) 2022 moxxos
+"""
+
+import json
+import os
+
+import pytest
+
+from gppc import _db, _mapping
+from gppc._index import _get_index
+
+
+@pytest.fixture
+def empty_home(tmp_path, monkeypatch):
+    """A gppc data directory without a cached mapping, returns the data directory."""
+    monkeypatch.setenv('XDG_DATA_HOME', str(tmp_path))
+    for key, value in (('raw_list', None), ('name_list', None), ('meta', {}),
+                       ('refreshing', False), ('attempted', 0.0)):
+        monkeypatch.setitem(_mapping._state, key, value)
+    return _db._appdata_path()
+
+
+@pytest.fixture
+def mapping_server(empty_home, fixture_server, monkeypatch):
+    url, paths = fixture_server
+    monkeypatch.setattr(_mapping, '_MAP_API', url + '/mapping')
+    return paths
+
+
+def _meta(data_dir: str) -> dict:
+    with open(os.path.join(data_dir, 'mapping_meta.json'), 'r', encoding='utf-8') as meta:
+        return json.load(meta)
+
+
+def test_first_load_fetches_and_caches(empty_home, mapping_server):
+    assert _get_index().find('Coal')['id'] == 453
+    assert mapping_server == ['/mapping']
+    assert os.path.isfile(os.path.join(empty_home, 'mapping.json'))
+    assert _meta(empty_home)['etag'].startswith('"')
+
+
+def test_revalidation_keeps_an_unchanged_mapping(empty_home, mapping_server):
+    _mapping._raw_list()
+    version, fetched = _mapping._mapping_version(), _meta(empty_home)['fetched']
+    _mapping._refresh_mapping()
+    # answered 304 Not Modified, only the fetch time moves on
+    assert len(mapping_server) == 2
+    assert _mapping._mapping_version() == version
+    assert _meta(empty_home)['fetched'] >= fetched
+
+
+def test_revalidation_replaces_a_changed_mapping(empty_home, mapping_server):
+    _mapping._raw_list()
+    version = _mapping._mapping_version()
+    _mapping._state['meta'] = {**_mapping._state['meta'], 'etag': '"outdated"'}
+    _mapping._refresh_mapping()
+    assert _mapping._mapping_version() == version + 1
+    assert _meta(empty_home)['etag'] != '"outdated"'
+
+
+def test_offline_first_load_caches_the_backup(empty_home, fixture_server, monkeypatch):
+    url, paths = fixture_server
+    monkeypatch.setattr(_mapping, '_MAP_API', url + '/missing')
+    monkeypatch.setattr(_mapping, '_start_revalidate', lambda: None)
+    assert _get_index().find('Abyssal whip') is not None
+    assert _meta(empty_home) == {'fetched': 0}
+    # a later start loads the cached backup without requesting the mapping again
+    _mapping._state['raw_list'] = None
+    _mapping._raw_list()
+    assert paths == ['/missing']
@@ -0,0 +1,60 @@
+"""
+Tests migration of the legacy per item history tables.
+
+Copyright (C) 2022 moxxos
+"""
+
+import sqlite3
+
+from gppc._db import DbManager
+
+DAY = 1699920000  # aligned to a day
+
+
+def _legacy_db(path: str, rows: list[tuple]) -> None:
+    legacy = sqlite3.connect(path)
+    legacy.execute('CREATE TABLE item453 (timestamp PRIMARY KEY, avgHighPrice, avgLowPrice, '
+                   'highPriceVolume, lowPriceVolume)')
+    legacy.executemany('INSERT INTO item453 VALUES (?, ?, ?, ?, ?)', rows)
+    legacy.commit()
+    legacy.close()
+
+
+def _rows(db, timestep: int) -> list[tuple]:
+    return [row[1:] for row in db.get_history_panel([453], timestep)]
+
+
+def test_migrate_item_tables(tmp_path):
+    path = str(tmp_path / 'gppc.sql')
+    # daily history, then hourly history from DAY and 5m history from DAY + 3h
+    _legacy_db(path, [(float(DAY - 2 * 86400), 140.0, 138.0, 900.0, 800.0),
+                      (float(DAY - 86400), 150.0, 148.0, 1000.0, 2000.0),
+                      (float(DAY), 151.0, None, 50.0, None),
+                      (float(DAY + 3600), 152.0, 149.0, 40.0, 30.0),
+                      (float(DAY + 7200), 153.0, 150.0, 45.0, 35.0),
+                      (float(DAY + 10800), '154', '151', '1', '2'),
+                      (float(DAY + 11100), 155.0, 152.0, 3.0, 4.0)])
+    db = DbManager(path)
+    db.store_item_history(453, [{'timestamp': DAY - 2 * 86400, 'avgHighPrice': 1,
+                                 'avgLowPrice': 1, 'highPriceVolume': 1,
+                                 'lowPriceVolume': 1}], 86400)
+    assert db.migrate_item_tables() == 1
+    assert db.migrate_item_tables() == 0  # the legacy table was dropped
+    # stored rows are kept
+    assert _rows(db, 86400) == [(DAY - 2 * 86400, 1, 1, 1, 1),
+                                (DAY - 86400, 150, 148, 1000, 2000)]
+    # hourly and 5m rows on day and hour boundaries keep their own timestep
+    assert _rows(db, 3600) == [(DAY, 151, None, 50, 0), (DAY + 3600, 152, 149, 40, 30),
+                               (DAY + 7200, 153, 150, 45, 35)]
+    assert _rows(db, 300) == [(DAY + 10800, 154, 151, 1, 2), (DAY + 11100, 155, 152, 3, 4)]
+    assert _rows(db, 21600) == []
+    db.close_db()
+
+
+def test_migrate_single_row_by_alignment(tmp_path):
+    path = str(tmp_path / 'gppc.sql')
+    _legacy_db(path, [(float(DAY + 21600), 150.0, 148.0, 10.0, 20.0)])
+    db = DbManager(path)
+    db.migrate_item_tables()
+    assert _rows(db, 21600) == [(DAY + 21600, 150, 148, 10, 20)]
+    db.close_db()
@@ -0,0 +1,51 @@
+"""
+Tests the retention policy and compaction of stored history.
+
+Copyright (C) 2022 moxxos
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from gppc import configure_retention
+
+from conftest import store_rows
+
+HOUR = 1699999200  # aligned to an hour but not to 6 hours
+
+
+def _rows(db, timestep: int) -> list[tuple]:
+    return [row[1:] for row in db.get_history_panel([453], timestep)]
+
+
+def test_compact_history_rolls_up_old_rows(db):
+    now = HOUR + 10 * 86400
+    old = [(HOUR + i * 300, 100 + i, 90 + i, 1 + i, 2) for i in range(12)]
+    recent = [(now - 600, 200, 190, 1, 1)]
+    store_rows(db, 453, 300, old + recent)
+    # a bucket that is already stored is not replaced by the roll-up
+    store_rows(db, 453, 300, [(HOUR + 3600, 500, 400, 3, 3)])
+    store_rows(db, 453, 3600, [(HOUR + 3600, 1, 1, 1, 1)])
+
+    summary = db.compact_history([(300, 86400), (3600, None)], now)
+    assert summary == {'rolled_up': 1, 'deleted': 13}
+    # volume weighted: high 8372 / 78 = 107.3, low 2292 / 24 = 95.5 rounded half up
+    assert _rows(db, 3600) == [(HOUR, 107, 96, 78, 24), (HOUR + 3600, 1, 1, 1, 1)]
+    assert _rows(db, 300) == [(now - 600, 200, 190, 1, 1)]
+    assert db.compact_history([(300, 86400), (3600, None)], now) == {'rolled_up': 0,
+                                                                     'deleted': 0}
+
+
+def test_compact_history_weights_prices_by_their_own_volume(db):
+    store_rows(db, 453, 300, [(HOUR, 100, None, 3, 0), (HOUR + 300, 111, 80, 1, 5)])
+    db.compact_history([(300, 0), (3600, None)], HOUR + 7200)
+    # (100 * 3 + 111) / 4, a missing low price neither counts as zero nor adds volume
+    assert _rows(db, 3600) == [(HOUR, 103, 80, 4, 5)]
+
+
+def test_configure_retention_rejects_bad_policies():
+    with pytest.raises(ValueError):
+        configure_retention({'1day': timedelta(days=1)})
+    with pytest.raises(ValueError):
+        configure_retention({'5m': -1})
@@ -0,0 +1,52 @@
+"""
+Tests local item search ranking and printing search results without network.
+
+Copyright (C) 2022 moxxos
+"""
+
+import requests
+
+from gppc import _gppc
+from gppc._search import _SearchIndex
+
+_NAMES = ['Rune scimitar', 'Rune scimitar ornament kit (guthix)', 'Dragon scimitar',
+          'Rune 2h sword', 'Rune', 'Scimitar of runes', 'Runite bar']
+
+
+def _search(query: str, **kwargs) -> list[str]:
+    index = _SearchIndex([{'id': i, 'name': name} for i, name in enumerate(_NAMES)])
+    return [record['name'] for record in index.search(query, **kwargs)]
+
+
+def test_ranks_exact_prefix_words_then_substring():
+    assert _search('rune') == ['Rune', 'Rune 2h sword', 'Rune scimitar',
+                               'Rune scimitar ornament kit (guthix)', 'Scimitar of runes']
+    # names starting with the query rank above names only containing every word
+    assert _search('RUNE  scim') == ['Rune scimitar', 'Rune scimitar ornament kit (guthix)',
+                                     'Scimitar of runes']
+    assert _search('scim rune') == ['Rune scimitar', 'Scimitar of runes',
+                                    'Rune scimitar ornament kit (guthix)']
+    assert _search('scimitar') == ['Scimitar of runes', 'Rune scimitar', 'Dragon scimitar',
+                                   'Rune scimitar ornament kit (guthix)']
+    assert _search('rune', limit=2) == ['Rune', 'Rune 2h sword']
+
+
+def test_fuzzy_matches_only_without_other_matches():
+    assert _search('rune scimtar')[0] == 'Rune scimitar'
+    assert _search('rune scimtar', fuzzy=False) == []
+    assert _search('') == []
+
+
+def test_rows_without_pictures_keep_their_lines(gppc_home, monkeypatch, capsys):
+    rows = [('Iron ore', '440', '-', '-', 'https://ge/440', 'https://ge/440.gif'),
+            ('Coal', '453', '-', '-', 'https://ge/453', 'https://ge/453.gif')]
+
+    def offline(pic_link: str) -> bytes:
+        raise requests.ConnectionError('offline')
+
+    monkeypatch.setattr(_gppc, '_iter_results', lambda *args: iter(rows))
+    monkeypatch.setattr(_gppc, '_fetch_icon', offline)
+    _gppc._search_print('rune scim')
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 6
+    assert 'Iron ore' in lines[0] and 'Coal' in lines[3]
@@ -0,0 +1,60 @@
+"""
+Tests whole market snapshot and latest price ingestion.
+
+Copyright (C) 2022 moxxos
+"""
+
+import json
+import os
+
+from gppc import Catalog
+from gppc import _item
+
+from conftest import FIXTURES
+
+
+def _fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES, name + '.json'), 'r', encoding='utf-8') as fixture:
+        return json.load(fixture)
+
+
+def test_store_snapshot_skips_items_without_trades(db):
+    assert db.store_snapshot(_fixture('5m'), 300) == 3
+    history = db.get_history_panel(timestep=300)
+    assert [row[0] for row in history] == [2, 453, 4151]
+    assert history[1] == (453, 1699999800, 152, None, 40211, 0)
+
+
+def test_store_snapshot_only_given_items(db):
+    assert db.store_snapshot(_fixture('5m'), 300, {453, 440}) == 1
+    assert [row[0] for row in db.get_history_panel()] == [453]
+
+
+def test_store_snapshot_ignores_stored_buckets(db):
+    db.store_snapshot(_fixture('5m'), 300)
+    assert db.store_snapshot(_fixture('5m'), 300) == 0
+    assert len(db.get_history_panel()) == 3
+
+
+def test_store_latest_replaces_prices(db):
+    latest = _fixture('latest')
+    assert db.store_latest(latest) == 3
+    latest['data']['453'] = {'high': 160, 'highTime': 1700000300, 'low': 155,
+                             'lowTime': 1700000200}
+    assert db.store_latest(latest, {453}) == 1
+    prices = db.get_latest([453, 2, 440])
+    assert prices[453] == (160, 1700000300, 155, 1700000200)
+    assert prices[2] == (172, 1700000000, None, None)
+    assert 440 not in prices
+
+
+def test_catalog_save_snapshot_is_one_request(gppc_home, fixture_server, monkeypatch):
+    url, paths = fixture_server
+    monkeypatch.setitem(_item._SNAPSHOT_API, '5m', url + '/5m')
+    monkeypatch.setitem(_item._SNAPSHOT_API, 'latest', url + '/latest')
+    catalog = Catalog('Coal', 'Abyssal whip', 'Iron ore')
+    assert catalog.save_snapshot('5m', timestamp=1699999800) == 2
+    assert catalog.save_snapshot('latest') == 2
+    assert paths == ['/5m?timestamp=1699999800', '/latest']
+    history = catalog.history('5m')
+    assert history.index.get_level_values('item').tolist() == ['Coal', 'Abyssal whip']
@@ -0,0 +1,108 @@
+"""
+Tests failover and hedging between history sources.
+
+Copyright (C) 2022 moxxos
+"""
+
+import threading
+import time
+
+import pytest
+import requests
+
+from gppc._source import _HistoryProvider
+
+
+class _Source():
+    """A history source answering after delay seconds, or raising error."""
+
+    def __init__(self, name: str, delay: float = 0, history=None, error=None,
+                 stored: bool = True, wait: float = 0) -> None:
+        self.name = name
+        self.stored = stored
+        self.delay = delay
+        self.wait = wait  # seconds spent waiting for the rate limit
+        self.history = [{'timestamp': 0}] if history is None else history
+        self.error = error
+        self.calls = 0
+
+    def supports(self, timestep: str) -> bool:
+        return True
+
+    def throttle(self) -> None:
+        time.sleep(self.wait)
+
+    def fetch(self, item_id: int, timestep: str) -> list[dict]:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.history
+
+
+def test_fails_over_in_order():
+    wiki = _Source('wiki', error=requests.ConnectionError('down'))
+    ge = _Source('ge', stored=False)
+    provider = _HistoryProvider([wiki, ge])
+    provider.configure(hedge=False)
+    assert provider.fetch(453, '24h') == (ge.history, 'ge')
+    assert not provider.stored('ge') and provider.stored('wiki')
+
+
+def test_raises_the_last_error_when_every_source_fails():
+    provider = _HistoryProvider([_Source('wiki', error=requests.ConnectionError('down')),
+                                 _Source('ge', error=ValueError('bad page'))])
+    with pytest.raises(ValueError):
+        provider.fetch(453, '24h')
+
+
+def test_slow_hedges_never_delay_first_requests():
+    wiki = _Source('wiki', delay=0.02)
+    ge = _Source('ge', delay=1)
+    provider = _HistoryProvider([wiki, ge])
+    provider.configure(hedge_percentile=1)
+    for _ in range(5):
+        provider.fetch(453, '24h')  # latency samples, hedging starts after them
+    latencies = []
+
+    def fetch():
+        for _ in range(5):
+            start = time.monotonic()
+            assert provider.fetch(453, '24h') == (wiki.history, 'wiki')
+            latencies.append(time.monotonic() - start)
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(latencies) < 0.5
+    # hedges were started but only as many as the hedge pool runs at once
+    assert 0 < ge.calls <= 4
+
+
+def test_hedge_answers_when_the_first_source_fails_slowly():
+    wiki = _Source('wiki', delay=0.01)
+    ge = _Source('ge', delay=0.2, stored=False)
+    provider = _HistoryProvider([wiki, ge])
+    provider.configure(hedge_percentile=50)
+    for _ in range(5):
+        provider.fetch(453, '24h')
+    wiki.delay, wiki.error = 0.5, requests.Timeout('slow')
+    start = time.monotonic()
+    assert provider.fetch(453, '24h') == (ge.history, 'ge')
+    # the hedge finished while the first request was still running and is not retried
+    assert ge.calls == 1
+    assert time.monotonic() - start < 0.65
+
+
+def test_rate_limit_waits_are_not_source_latency():
+    wiki = _Source('wiki', delay=0.01, wait=0.2)
+    ge = _Source('ge', stored=False)
+    provider = _HistoryProvider([wiki, ge])
+    provider.configure(hedge_percentile=50)
+    for _ in range(6):
+        assert provider.fetch(453, '24h') == (wiki.history, 'wiki')
+    assert provider.stats()['wiki']['p99'] < 0.1
+    # the hedge delay starts after the wait, so no hedge was sent
+    assert ge.calls == 0
@@ -0,0 +1,61 @@
+"""
+Tests syncing only the stale timesteps of stored history.
+
+Copyright (C) 2022 moxxos
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from gppc import Catalog, Item, clear_history_cache, configure_history_sources
+from gppc import _source
+
+NOW = 1700000000  # 200 seconds into a 5m bucket
+ALL = ['5m', '1h', '6h', '24h']
+
+
+def test_stale_timesteps(gppc_home):
+    coal = Item('Coal')
+    assert coal._stale_timesteps({}, now=NOW) == ALL
+    # the newest finished 5m bucket starts at NOW - 500, nothing newer can exist yet
+    fresh = {(453, 300): (NOW - 500, NOW - 86400)}
+    assert '5m' not in coal._stale_timesteps(fresh, now=NOW)
+    behind = {(453, 300): (NOW - 800, NOW - 100), (453, 3600): (NOW - 90000, NOW - 1000)}
+    assert coal._stale_timesteps(behind, now=NOW) == ['6h', '24h']
+    assert coal._stale_timesteps(behind, max_age=60, now=NOW) == ALL
+    assert coal._stale_timesteps(behind, max_age=timedelta(minutes=5), now=NOW) == ['1h', '6h',
+                                                                                    '24h']
+    assert Item('Iron ore')._stale_timesteps(behind, now=NOW) == ALL
+
+
+@pytest.fixture
+def history_server(gppc_home, fixture_server, monkeypatch):
+    """
+    Serve tests/fixtures/timeseries.json as the history of every item and timestep.
+    Hedging is off, requests to the local server are too fast for stable latency percentiles.
+    """
+    url, paths = fixture_server
+    monkeypatch.setattr(_source, '_HISTORY_API',
+                        url + '/timeseries?timestep=' + _source._TIMESTEP_PARAMETER + '&id=')
+    monkeypatch.setattr(_source, '_ITEM_URL', url + '/viewitem?obj=')
+    clear_history_cache()
+    configure_history_sources(hedge=False)
+    yield paths
+    configure_history_sources(hedge=True)
+    clear_history_cache()
+
+
+def test_catalog_sync_requests_only_stale_timesteps(history_server):
+    catalog = Catalog('Coal', 'Iron ore')
+    summary = catalog.sync()
+    assert summary == {name: {'success': True, 'rows': 8, 'error': None}
+                       for name in ('Coal', 'Iron ore')}
+    assert len(history_server) == 8
+    assert catalog.history('5m')['avgHighPrice'].tolist() == [152, 153, 152, 153]
+    # just synced, every timestep is fresh for its own width
+    assert catalog.sync()['Coal'] == {'success': True, 'rows': 0, 'error': None}
+    assert len(history_server) == 8
+    clear_history_cache()
+    assert catalog.sync(max_age=0)['Coal']['rows'] == 0
+    assert len(history_server) == 16